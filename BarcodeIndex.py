@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    my class BarcodeIndex
+"""
+
+import os, tempfile
+from collections import OrderedDict
+
+OFFSET = 15        # width of the offsets in the index
+CACHE = 100000     # number of barcodes kept in memory
+
+
+class BarcodeIndex:
+    '''
+        Reads the barcodes of a bci file on demand, like the dict of
+        store_bx(), through a sorted table of barcodes and offsets
+        (bci.bcx, built if missing or older than the bci file).
+        The last read barcodes are kept in memory.
+
+        bci -- bci file got by LRez (not compressed)
+        size -- number of barcodes kept in memory
+    '''
+    def __init__(self,bci,size=CACHE):
+        with open(bci,"rb") as filin:
+            if filin.read(2) in (b"\x1f\x8b",b"\x28\xb5"):
+                raise ValueError(bci+": the barcode index needs an uncompressed bci file")
+        self.bci = bci
+        self.file = bci+".bcx"
+        self.size = size
+        self.cache = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        if not os.path.exists(self.file) or os.path.getmtime(self.file) < os.path.getmtime(bci):
+            self.build()
+        self.index = open(self.file,"rb")
+        head = self.index.readline().split()
+        self.width = int(head[1])
+        self.n = int(head[2])
+        self.start = self.index.tell()
+        self.record = self.width + OFFSET + 2
+        self.filin = open(bci,"rb")
+
+    def build(self):
+        '''
+            Writes the index: a head line, then one line for each barcode, as
+            the barcode padded to the same width and its offset in the bci file.
+        '''
+        T = []
+        offset = 0
+        with open(self.bci,"rb") as filin:
+            for line in filin:
+                if b";" in line:
+                    T.append((line[:line.index(b";")],offset))
+                offset += len(line)
+        width = max([len(bx) for (bx,offset) in T],default=1)
+        T.sort(key=lambda t: t[0].ljust(width))
+        # unique temporary file of the same directory: concurrent runs never share it
+        fd,tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.file)))
+        try:
+            with os.fdopen(fd,"wb") as filout:
+                filout.write(b"BCX "+str(width).encode()+b" "+str(len(T)).encode()+b"\n")
+                for (bx,offset) in T:
+                    filout.write(bx.ljust(width)+b" "+str(offset).zfill(OFFSET).encode()+b"\n")
+            # mkstemp creates the file readable by its owner only :
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp,0o666 & ~umask)
+            os.replace(tmp,self.file)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def get_offset(self,bx):
+        '''
+            Returns the offset of a barcode in the bci file (binary search in
+            the index), None if it is not in the bci file.
+        '''
+        key = bx.encode().ljust(self.width)
+        a = 0
+        b = self.n
+        while a < b:
+            i = (a + b) // 2
+            self.index.seek(self.start + i * self.record)
+            rec = self.index.read(self.record)
+            if rec[:self.width] < key:
+                a = i + 1
+            else:
+                b = i
+        if a < self.n:
+            self.index.seek(self.start + a * self.record)
+            rec = self.index.read(self.record)
+            if rec[:self.width] == key:
+                return int(rec[self.width+1:self.width+1+OFFSET])
+        return None
+
+    def __getitem__(self,bx):
+        '''
+            Returns the linked-reads of a barcode (string chrom:pos:length,...).
+        '''
+        self.lookups += 1
+        if bx in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(bx)
+            return self.cache[bx]
+        offset = self.get_offset(bx)
+        if offset is None:
+            raise KeyError(bx)
+        self.filin.seek(offset)
+        value = self.filin.readline().decode().rstrip().split(";")[1]
+        self.cache[bx] = value
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+        return value
+
+    def __contains__(self,bx):
+        return bx in self.cache or self.get_offset(bx) is not None
+
+    def report(self):
+        '''
+            Returns the lookup statistics as a string.
+        '''
+        return "barcode index: "+str(self.n)+" barcodes, "+str(self.lookups)+" lookups, "+str(self.hits)+" in memory"
+
+    def close(self):
+        self.index.close()
+        self.filin.close()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    my class Blacklist
+"""
+
+from threading import Lock
+from readers import open_text
+
+
+class Blacklist:
+    '''
+        Barcodes whose reads are skipped by the metrics (failed GEMs, barcode
+        collisions...), read from a file made by bcistats.py, one barcode
+        (as in the bci file) by line.
+        The BX tags of the reads (barcode followed by -GEM group) are checked
+        as they are, before being cut to the barcode.
+
+        file -- text file
+    '''
+    def __init__(self,file):
+        with open_text(file) as filin:
+            self.barcodes = frozenset([line.rstrip() for line in filin if line.strip() != ""])
+        # barcodes as in the bci file and as BX tags :
+        self.names = self.barcodes.union([bx+"-"+str(g) for bx in self.barcodes for g in range(10)])
+        self.reads = 0
+        self.skipped = set()
+        self.lock = Lock()
+
+    def __contains__(self,bx):
+        '''
+            Returns True if a barcode (as in the bci file or as a BX tag) is
+            blacklisted.
+        '''
+        return bx in self.names
+
+    def count(self,reads,skipped):
+        '''
+            Adds the reads and the barcodes skipped by a query (thread-safe).
+
+            reads -- number of skipped reads
+            skipped -- set of skipped barcodes
+        '''
+        with self.lock:
+            self.reads += reads
+            self.skipped.update(skipped)
+
+    def report(self):
+        '''
+            Returns the number of skipped reads and barcodes as a string.
+        '''
+        return "blacklist: "+str(len(self.barcodes))+" barcodes, "+str(len(self.skipped))+" filtered, "+str(self.reads)+" reads skipped"
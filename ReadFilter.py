@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    my class ReadFilter
+"""
+
+from threading import Lock
+
+# flag bits of the reads that can be filtered out
+FLAGS = {"secondary" : 0x100,
+         "supplementary" : 0x800,
+         "duplicate" : 0x400,
+         "qcfail" : 0x200}
+
+
+class ReadFilter:
+    '''
+        Reads skipped by the metrics, selected on their flag and MAPQ only,
+        before their BX tag is read.
+        The dropped reads are counted per fetch, separately for each pass
+        (stage) over the reads: a read fetched twice is counted twice.
+
+        mapq -- minimal mapping quality of the reads
+        flags -- list of kinds of reads filtered out (keys of FLAGS)
+    '''
+    def __init__(self,mapq=0,flags=[]):
+        self.mapq = mapq
+        self.kinds = [kind for kind in FLAGS if kind in flags]
+        self.mask = 0
+        for kind in self.kinds:
+            self.mask |= FLAGS[kind]
+        self.names = self.kinds + (["mapq"] if mapq > 0 else [])
+        self.dropped = {} # stage -> number of reads dropped by each filter
+        self.lock = Lock()
+
+    def settings(self):
+        '''
+            Returns the filter settings, as a key of RegionCache (tuple).
+        '''
+        return (self.mask,self.mapq)
+
+    def get_kind(self,read):
+        '''
+            Returns the first filter dropping a read.
+        '''
+        for kind in self.kinds:
+            if read.flag & FLAGS[kind]:
+                return kind
+        return "mapq"
+
+    def filtered(self,file,args,stage):
+        '''
+            Yields the reads of file.fetch(*args) that are kept, and counts the
+            dropped ones under stage (thread-safe).
+        '''
+        mask = self.mask
+        mapq = self.mapq
+        dropped = []
+        for read in file.fetch(*args):
+            if read.flag & mask or read.mapping_quality < mapq:
+                dropped.append(self.get_kind(read))
+                continue
+            yield read
+        with self.lock:
+            counts = self.dropped.setdefault(stage,{kind : 0 for kind in self.names})
+            for kind in dropped:
+                counts[kind] += 1
+
+    def report(self):
+        '''
+            Returns the number of reads dropped by each filter in each stage as
+            a string.
+        '''
+        if not self.dropped:
+            return "filters: no read fetched"
+        stages = [stage + ": " + ", ".join([kind + "=" + str(n) for kind,n in counts.items()]) for stage,counts in self.dropped.items()]
+        return "filters (reads dropped per fetch, a read fetched twice is counted twice): " + "; ".join(stages)
+
+
+def fetch_reads(file,filters,*args,stage="regions"):
+    '''
+        Returns the reads of file.fetch(*args), without those dropped by the
+        filters.
+
+        file -- a samfile
+        filters -- ReadFilter object (None for no filter)
+        stage -- pass over the reads under which the dropped reads are counted
+                 ("regions", "windows" or "chromosomes")
+    '''
+    if filters is None or (filters.mask == 0 and filters.mapq <= 0):
+        return file.fetch(*args)
+    return filters.filtered(file,args,stage)
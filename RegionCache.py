@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    my class RegionCache
+"""
+
+import heapq
+from bisect import bisect_left
+from collections import OrderedDict
+from ReadFilter import fetch_reads
+
+READ_BYTES = 200 # approximate memory used by one cached read (tuple, positions and its own barcode string)
+
+
+class RegionCache:
+    '''
+        Keeps the barcoded reads of the fetched regions, so that identical,
+        nested or overlapping regions are not fetched again.
+        The least recently used regions are evicted when the memory budget
+        is exceeded.
+
+        budget -- memory budget in bytes
+    '''
+    def __init__(self,budget):
+        self.budget = budget
+        self.size = 0
+        self.entries = OrderedDict() # (chrom,start,end,settings) -> (starts,reads,longest)
+        self.index = {}               # (chrom,settings) -> [starts,keys,longest] of the cached regions, sorted by start
+        self.hits = 0
+        self.nested = 0
+        self.extended = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncached = 0
+
+    def read_all(self,file,chrom,start,end,filters=None):
+        '''
+            Returns the barcoded reads of a region, kept by the filters, as a
+            list of (start,end,bx) sorted by start.
+        '''
+        reads = []
+        for read in fetch_reads(file,filters,chrom,start,end):
+            if read.has_tag('BX'):
+                bx = read.get_tag('BX')
+                a = read.reference_start
+                b = read.reference_end if read.reference_end is not None else a + 1
+                reads.append((a,b,bx))
+        reads.sort(key=lambda r: r[0])
+        return reads
+
+    def find(self,chrom,start,end,settings):
+        '''
+            Returns the key of a cached region overlapping the region, a key
+            containing it if there is one (None if no region overlaps).
+        '''
+        if (chrom,settings) not in self.index:
+            return None
+        [starts,keys,longest] = self.index[(chrom,settings)]
+        found = None
+        # regions starting before end and ending after start :
+        for key in keys[bisect_left(starts,start - longest):bisect_left(starts,end)]:
+            if start < key[2]:
+                if key[1] <= start and end <= key[2]:
+                    return key
+                found = key
+        return found
+
+    def store(self,key,reads):
+        '''
+            Stores the reads of a region and evicts the least recently used
+            regions until the cache fits its budget.
+        '''
+        size = len(reads) * READ_BYTES
+        if size > self.budget:
+            self.uncached += 1
+            return
+        longest = max([b - a for (a,b,bx) in reads],default=0)
+        self.entries[key] = ([r[0] for r in reads],reads,longest)
+        self.size += size
+        index = self.index.setdefault((key[0],key[3]),[[],[],0])
+        i = bisect_left(index[1],key)
+        index[0].insert(i,key[1])
+        index[1].insert(i,key)
+        index[2] = max(index[2],key[2] - key[1])
+        while self.size > self.budget:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self,key):
+        '''
+            Removes a region from the cache.
+        '''
+        (starts,reads,longest) = self.entries.pop(key)
+        self.size -= len(reads) * READ_BYTES
+        index = self.index[(key[0],key[3])]
+        i = bisect_left(index[1],key)
+        del index[0][i]
+        del index[1][i]
+        if index[1] == []:
+            del self.index[(key[0],key[3])]
+
+    def fetch(self,file,chrom,start,end,filters=None):
+        '''
+            Returns the barcoded reads (start,end,bx) overlapping a region, as
+            file.fetch() would.
+
+            file -- a samfile
+            chrom -- chromosome name
+            start -- region's start position
+            end -- region's end position
+            filters -- ReadFilter object (None for no filter), its settings are part of the key
+        '''
+        settings = (file.filename,) + (filters.settings() if filters is not None else ())
+        key = self.find(chrom,start,end,settings)
+        if key is None:
+            self.misses += 1
+            reads = self.read_all(file,chrom,start,end,filters)
+            self.store((chrom,start,end,settings),reads)
+            return reads
+        (starts,reads,longest) = self.entries[key]
+        if key[1] <= start and end <= key[2]:
+            self.entries.move_to_end(key)
+            if key[1] == start and key[2] == end:
+                self.hits += 1
+                return reads
+            self.nested += 1
+        else:
+            # only fetches the flanks missing from the cached region :
+            self.extended += 1
+            left = []
+            right = []
+            if start < key[1]:
+                left = [r for r in self.read_all(file,chrom,start,key[1],filters) if r[1] <= key[1]]
+            if key[2] < end:
+                right = [r for r in self.read_all(file,chrom,key[2],end,filters) if r[0] >= key[2]]
+            # the right flank starts after the cached reads, the left one is merged in order :
+            reads = list(heapq.merge(left,reads,key=lambda r: r[0])) + right
+            self.remove(key)
+            key = (chrom,min(start,key[1]),max(end,key[2]),settings)
+            self.store(key,reads)
+            starts = [r[0] for r in reads]
+            longest = max([b - a for (a,b,bx) in reads],default=0)
+        # reads starting before end and ending after start :
+        i = bisect_left(starts,start - longest)
+        j = bisect_left(starts,end)
+        return [r for r in reads[i:j] if r[1] > start]
+
+    def stats(self):
+        '''
+            Returns the cache statistics (dict).
+        '''
+        return {"hits" : self.hits,
+                "nested" : self.nested,
+                "extended" : self.extended,
+                "misses" : self.misses,
+                "evictions" : self.evictions,
+                "uncached" : self.uncached,
+                "regions" : len(self.entries),
+                "bytes" : self.size,
+                "budget" : self.budget}
+
+    def report(self):
+        '''
+            Returns the cache statistics as a string.
+        '''
+        return "cache: " + ", ".join([k + "=" + str(v) for k,v in self.stats().items()])
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Statistics of the molecules of a BCI file and dataset-specific thresholds for work2.
+"""
+
+
+import argparse, json
+import numpy as np
+from readers import open_text
+
+N_GAP = 5000     # default space allowed between linked-reads in cluster
+MIN_READS = 6    # default number of linked-reads in a cluster
+MAX_FOLD = 10    # barcodes with more than MAX_FOLD times the median number of molecules, of reads or of covered span are blacklisted
+MIN_QUANTILE = 25 # MIN_READS keeps the molecules above this percentile of their number of linked-reads
+CHUNK = 1 << 24  # number of bytes of the bci file parsed at once
+
+
+def grow(arrays,size):
+    '''
+        Returns the arrays with room for at least size values (the values are kept).
+    '''
+    if size <= len(arrays[0]):
+        return arrays
+    new = []
+    for a in arrays:
+        b = np.empty(max(2 * len(a),size),dtype=a.dtype)
+        b[:len(a)] = a
+        new.append(b)
+    return new
+
+
+def load_bci(bci):
+    '''
+        Reads a BCI file and returns its linked-reads as numpy arrays
+        (barcode index, chromosome index, position, length) and the names of
+        the barcodes and of the chromosomes.
+        The file is parsed by chunks, straight into the arrays: the
+        chromosome names are cut out and coded by numpy, then the numbers
+        are read by numpy.
+
+        bci -- file, each line is as bx;chrom:pos:length,chrom:pos:length...
+    '''
+    names = []
+    codes = {} # chromosome -> code
+    arrays = [np.empty(1 << 20,dtype=np.int32) for i in range(4)]
+    k = 0
+    with open_text(bci) as filin:
+        lines = filin.buffer.readlines(CHUNK)
+        while lines != []:
+            B = []
+            F = []
+            for line in lines:
+                i = line.find(b";")
+                f = line[i+1:].strip()
+                if i < 0 or f == b"":
+                    continue
+                B.append(f.count(b",") + 1)
+                names.append(line[:i].decode())
+                F.append(f)
+            v = np.frombuffer(b",".join(F),dtype=np.uint8)
+            m = sum(B)
+            # first character of each linked-read and end of its chromosome name :
+            starts = np.concatenate(([0],np.flatnonzero(v == ord(","))+1))
+            ends = np.flatnonzero(v == ord(":"))[0::2]
+            # chromosome names of the linked-reads, as rows of characters :
+            w = int((ends - starts).max())
+            M = np.zeros((m,w),dtype=np.uint8)
+            for j in range(w):
+                inside = starts + j < ends
+                M[inside,j] = v[starts[inside] + j]
+            # only the names that change from a linked-read to the next are decoded :
+            change = np.ones(m,dtype=bool)
+            change[1:] = (M[1:] != M[:-1]).any(axis=1)
+            first = np.flatnonzero(change)
+            u,inv = np.unique(M[first].view("S"+str(w)).ravel(),return_inverse=True)
+            C = np.array([codes.setdefault(c.decode(),len(codes)) for c in u.tolist()],dtype=np.int32)[inv]
+            # numbers without the chromosome names :
+            name = np.zeros(len(v) + 1,dtype=np.int8)
+            name[starts] = 1
+            name[ends + 1] = -1
+            digits = v[np.cumsum(name[:-1],dtype=np.int8) == 0]
+            digits[digits == ord(":")] = ord(",")
+            f = np.fromstring(digits.tobytes().decode(),dtype=np.int64,sep=",").reshape(-1,2)
+            arrays = grow(arrays,k + m)
+            (bx,chrom,pos,n) = arrays
+            bx[k:k+m] = np.repeat(np.arange(len(names) - len(B),len(names),dtype=np.int32),B)
+            chrom[k:k+m] = np.repeat(C,np.diff(np.append(first,m)))
+            pos[k:k+m] = f[:,0]
+            n[k:k+m] = f[:,1]
+            k += m
+            lines = filin.buffer.readlines(CHUNK)
+    # chromosome indexes in the order of their names :
+    chroms = sorted(codes)
+    rank = np.zeros(len(codes),dtype=np.int32)
+    for (i,c) in enumerate(chroms):
+        rank[codes[c]] = i
+    (bx,chrom,pos,n) = [a[:k] for a in arrays]
+    return (bx,rank[chrom],pos,n),names,chroms
+
+
+def get_gaps(reads):
+    '''
+        Sorts the linked-reads by barcode, chromosome and position, and returns
+        the space between each linked-read and the previous one, as partition()
+        does, and whether the barcode or the chromosome changes (numpy arrays).
+
+        reads -- arrays from load_bci()
+    '''
+    (bx,chrom,pos,n) = reads
+    order = np.lexsort((pos,chrom,bx))
+    for a in reads:
+        a[:] = a[order]
+    gaps = np.zeros(len(pos),dtype=np.int64)
+    gaps[1:] = pos[1:] - pos[:-1] - n[:-1]
+    new = np.ones(len(pos),dtype=bool)
+    new[1:] = (bx[1:] != bx[:-1]) | (chrom[1:] != chrom[:-1])
+    return gaps,new
+
+
+def get_molecules(reads,gaps,new,gap):
+    '''
+        Returns the length, the number of linked-reads and the barcode index
+        of each molecule (numpy arrays), linked-reads being in the same
+        molecule if they are at most gap apart.
+
+        reads -- arrays sorted by get_gaps()
+        gaps,new -- arrays from get_gaps()
+        gap -- space allowed between linked-reads in a molecule
+    '''
+    (bx,chrom,pos,n) = reads
+    first = np.flatnonzero(new | (gaps > gap))
+    nb = np.diff(np.append(first,len(pos)))
+    end = pos + n
+    length = np.maximum.reduceat(end,first) - pos[first]
+    return length,nb,bx[first]
+
+
+def propose_gap(gaps,default=N_GAP):
+    '''
+        Returns the space between linked-reads separating molecules: the
+        deepest point of the histogram of log10(gaps) between the mode of the
+        gaps inside molecules and the mode of the gaps between molecules.
+
+        gaps -- gaps inside a barcode and a chromosome, from get_gaps()
+        default -- value returned when the histogram has a single mode
+    '''
+    g = gaps[gaps > 0]
+    if len(g) == 0:
+        return default
+    h,edges = np.histogram(np.log10(g),bins=60)
+    h = np.convolve(h,np.ones(3) / 3,mode="same")
+    m1 = int(np.argmax(h))
+    if m1 + 2 >= len(h):
+        return default
+    m2 = m1 + 1 + int(np.argmax(h[m1+1:]))
+    valley = m1 + int(np.argmin(h[m1:m2+1]))
+    if valley == m1 or valley == m2:
+        return default
+    return int(round(10 ** edges[valley+1],-2))
+
+
+def get_blacklist(reads,length,mol_bx,nb_bx,max_molecules=None,max_reads=None):
+    '''
+        Returns the indexes of the barcodes with too many molecules, too many
+        reads or a too large covered span (failed GEMs, barcode collisions...),
+        the number of reads, of molecules and the covered span of each barcode,
+        and the maximal number of molecules, of reads and covered span.
+
+        reads -- arrays from load_bci()
+        length -- length of each molecule, from get_molecules()
+        mol_bx -- barcode index of each molecule, from get_molecules()
+        nb_bx -- number of barcodes
+        max_molecules -- maximal number of molecules (None for MAX_FOLD times the median)
+        max_reads -- maximal number of reads (None for MAX_FOLD times the median)
+    '''
+    nb_reads = np.bincount(reads[0],minlength=nb_bx)
+    nb_mol = np.bincount(mol_bx,minlength=nb_bx)
+    span = np.bincount(mol_bx,weights=length,minlength=nb_bx)
+    if max_molecules is None:
+        max_molecules = MAX_FOLD * max(float(np.median(nb_mol)),1)
+    if max_reads is None:
+        max_reads = MAX_FOLD * max(float(np.median(nb_reads)),1)
+    max_span = MAX_FOLD * max(float(np.median(span)),1)
+    B = np.flatnonzero((nb_mol > max_molecules) | (nb_reads > max_reads) | (span > max_span))
+    return B,nb_reads,nb_mol,span,max_molecules,max_reads,max_span
+
+
+def summary(a):
+    '''
+        Returns the mean and the quantiles of an array (dict).
+    '''
+    if len(a) == 0:
+        return {}
+    q = np.percentile(a,[5,25,50,75,95])
+    return {"mean" : float(a.mean()),
+            "q05" : float(q[0]),
+            "q25" : float(q[1]),
+            "median" : float(q[2]),
+            "q75" : float(q[3]),
+            "q95" : float(q[4])}
+
+
+def profile(bci,out,blacklist=None,max_molecules=None,max_reads=None):
+    '''
+        Computes the statistics of the molecules of a BCI file and writes them
+        with the proposed N_GAP and MIN_READS in a json profile for work2.
+
+        bci -- bci file got by LRez
+        out -- json file
+        blacklist -- file where the barcodes with too many molecules, reads or covered span are written (None for none)
+        max_molecules -- maximal number of molecules of a barcode (None for MAX_FOLD times the median)
+        max_reads -- maximal number of reads of a barcode (None for MAX_FOLD times the median)
+    '''
+    reads,names,chroms = load_bci(bci)
+    gaps,new = get_gaps(reads)
+    gap = propose_gap(gaps[~new])
+    length,nb,mol_bx = get_molecules(reads,gaps,new,gap)
+    # most molecules are kept: lower percentile of the number of linked-reads
+    # of the molecules (single linked-reads are not molecules) :
+    mol = nb[nb > 1]
+    min_reads = max(int(np.percentile(mol,MIN_QUANTILE)),2) if len(mol) > 0 else MIN_READS
+    P = {"bci" : bci,
+         "N_GAP" : gap,
+         "MIN_READS" : min_reads,
+         "barcodes" : len(names),
+         "reads" : len(gaps),
+         "chromosomes" : chroms,
+         "molecules" : len(nb),
+         "molecule_length" : summary(length),
+         "reads_per_molecule" : summary(nb),
+         "gap" : summary(gaps[~new])}
+    if blacklist is not None:
+        B,nb_reads,nb_mol,span,max_molecules,max_reads,max_span = get_blacklist(reads,length,mol_bx,len(names),max_molecules,max_reads)
+        with open(blacklist,"w") as filout:
+            for i in B:
+                filout.write(names[i]+"\n")
+        P["blacklist"] = {"file" : blacklist,
+                          "max_molecules" : float(max_molecules),
+                          "max_reads" : float(max_reads),
+                          "max_span" : float(max_span),
+                          "barcodes" : len(B),
+                          "reads" : int(nb_reads[B].sum()),
+                          "molecules" : int(nb_mol[B].sum())}
+        print(len(B),"barcodes blacklisted")
+    with open(out,"w") as filout:
+        json.dump(P,filout,indent=4)
+    print("N_GAP",gap,"MIN_READS",min_reads)
+    return P
+
+####################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Statistics of a BCI file')
+    parser.add_argument('-bci', type=str, required=True, help='bci file got by LRez')
+    parser.add_argument('-o', type=str, default='profile.json', help='json profile for work2')
+    parser.add_argument('-blacklist', type=str, default=None, help='File where the barcodes with too many molecules, reads or covered span are written')
+    parser.add_argument('-max_molecules', type=int, default=None, help='Maximal number of molecules of a barcode (default: '+str(MAX_FOLD)+' times the median)')
+    parser.add_argument('-max_reads', type=int, default=None, help='Maximal number of reads of a barcode (default: '+str(MAX_FOLD)+' times the median)')
+    args = parser.parse_args()
+    profile(args.bci,args.o,args.blacklist,args.max_molecules,args.max_reads)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Regions of the variants of a vcf file, BND variants being grouped.
+"""
+
+
+from Variant import Variant
+
+
+def get_chrom_bnd(v):
+    '''
+        Returns the chromosome name of a BND variant.
+
+        v -- Variant object
+    '''
+    c = v.alt.split(':')
+    if '[' in c[0]:
+        c = c[0].split('[')
+        return c[1]
+    else:
+        c = c[0].split(']')
+        return c[1]
+
+
+def get_pos_bnd(v):
+    '''
+        Returns the position in ALT attribute of a BND variant.
+
+        v -- Variant object
+    '''
+    c = v.alt.split(':')
+    try:
+        c = c[1].split(']')
+        return int(c[0])
+    except ValueError:
+        c = c[0].split('[')
+        return int(c[0])
+
+
+def get_events(filin):
+    '''
+        Yields, for each variant of a vcf file, the regions to evaluate (list
+        of [chrom,start,end]) and True if no BND group is pending.
+        Consecutive BND variants between the same chromosomes are grouped in
+        two regions, evaluated when a variant of another kind is read, or
+        with the last variant of the file. A group of a single BND (its mate
+        is not next to it) is dropped and reported at the end of the file.
+
+        filin -- vcf file (opened), or lines of a vcf file
+    '''
+    L = []
+    # Used to store current chromosomes for BND, and to output BND when changing chromosome
+    curChr1 = ""
+    curChr2 = ""
+    single = [] # groups of a single BND, dropped
+    # skips file's head :
+    lines = (line for line in filin if not line.startswith('#'))
+    line = next(lines,'')
+    # for each variant :
+    while line != '':
+        v = Variant(line)
+        regions = []
+        # We keep filling L if both chromosomes correspond to current one
+        # If not, this means we're not processing the same variant anymore, so we treat the BND we've read so far
+        if v.get_svtype() == "BND" and ((curChr1 == "" and curChr2 == "") or (curChr1 == v.chrom and curChr2 == get_chrom_bnd(v))):
+            if L == []:
+                L.append([v.chrom,v.pos,-1])
+                L.append([get_chrom_bnd(v),get_pos_bnd(v),-1])
+                curChr1 = v.chrom
+                curChr2 = get_chrom_bnd(v)
+            else:
+                if v.pos > L[0][2]:
+                    L[0][2] = v.pos
+                if get_pos_bnd(v) > L[1][2]:
+                    L[1][2] = get_pos_bnd(v)
+        else:
+            # we treat the BND variants :
+            if L != [] and L[0][2] != -1 and L[1][2] != -1:
+                regions.append(L[0])
+                regions.append(L[1])
+                L = []
+            elif L != []:
+                # a single BND never fills the group: it is dropped, not kept for a later BND
+                single.append(L[0][0]+":"+str(L[0][1]))
+                L = []
+            if L == []:
+                # Update current chromosomes and L if we read a BND, otherwise set them / leave them empty
+                if v.get_svtype() == "BND":
+                    L.append([v.chrom,v.pos,-1])
+                    L.append([get_chrom_bnd(v),get_pos_bnd(v),-1])
+                    curChr1 = v.chrom
+                    curChr2 = get_chrom_bnd(v)
+                else:
+                    curChr1 = ""
+                    curChr2 = ""
+            # treatment of a non BND variant :
+            # Only do if we didn't read a BND
+            if v.get_svtype() != "BND":
+                regions.append([v.chrom,v.pos,v.get_end()])
+        line = next(lines,'')
+        # the BND group pending at the end of the file is treated with the last variant :
+        if line == '' and L != [] and L[0][2] != -1 and L[1][2] != -1:
+            regions.append(L[0])
+            regions.append(L[1])
+            L = []
+            curChr1 = ""
+            curChr2 = ""
+        elif line == '' and L != []:
+            single.append(L[0][0]+":"+str(L[0][1]))
+        if line == '' and single != []:
+            print(len(single),"BND variants not followed by a BND between the same chromosomes, not evaluated:"," ".join(single[:10])+(" ..." if len(single) > 10 else ""))
+        yield regions,(L == [] and curChr1 == "" and curChr2 == "")
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Opening of bam/cram files and queries of several files (libraries) of the same sample at once.
+"""
+
+
+import hashlib, os, pysam, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+# fields decoded from cram files: FLAG, RNAME, POS, MAPQ, CIGAR and the tags (BX)
+CRAM_FIELDS = 0x2 | 0x4 | 0x8 | 0x10 | 0x20 | 0x800
+
+
+def cache_path(ref_cache,md5):
+    '''
+        Returns the path of a sequence in a reference cache of htslib.
+
+        ref_cache -- directory of the cache
+        md5 -- md5 of the sequence
+    '''
+    return os.path.join(ref_cache,md5[:2],md5[2:4],md5[4:])
+
+
+def write_cache(path,seq):
+    '''
+        Writes a sequence in a reference cache, through a temporary file of the
+        same directory so that concurrent runs never read a partial sequence.
+
+        path -- path of the sequence in the cache
+        seq -- sequence (uppercase)
+    '''
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    fd,tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd,"w") as filout:
+            filout.write(seq)
+        # mkstemp creates the file readable by its owner only :
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp,0o666 & ~umask)
+        os.replace(tmp,path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def populate_ref_cache(reference,ref_cache,md5s=None):
+    '''
+        Copies the sequences of a fasta file in a reference cache of htslib
+        (ref_cache/xx/yy/md5), once for all the runs.
+        With the M5 values of a cram header, only the missing sequences are
+        read; else a marker keyed on the path and the mtime of the fasta file
+        skips the fasta files already copied.
+
+        reference -- fasta file of the genome reference
+        ref_cache -- directory of the cache
+        md5s -- dict of the md5 of each sequence needed (None for all the sequences)
+    '''
+    if md5s is not None:
+        missing = set([chrom for (chrom,md5) in md5s.items() if not os.path.exists(cache_path(ref_cache,md5))])
+        if not missing:
+            return
+        marker = None
+    else:
+        path = os.path.abspath(reference)
+        marker = os.path.join(ref_cache,"fasta",hashlib.md5(path.encode()).hexdigest())
+        stamp = path+"\t"+str(os.stat(reference).st_mtime_ns)
+        if os.path.exists(marker):
+            with open(marker) as filin:
+                if filin.read() == stamp:
+                    return
+    fasta = pysam.FastaFile(reference)
+    for chrom in fasta.references:
+        if marker is None and chrom not in missing:
+            continue
+        seq = fasta.fetch(chrom).upper()
+        md5 = hashlib.md5(seq.encode()).hexdigest()
+        path = cache_path(ref_cache,md5)
+        if not os.path.exists(path):
+            write_cache(path,seq)
+    fasta.close()
+    if marker is not None:
+        write_cache(marker,stamp)
+
+
+def open_alignment(bam,reference=None,ref_cache=None,threads=1):
+    '''
+        Returns a samfile for a bam or a cram file.
+        Cram files are decoded with a local reference only (no download), and
+        only the fields needed by the metrics are decoded.
+
+        bam -- bam or cram file
+        reference -- fasta file of the genome reference (needed for cram files)
+        ref_cache -- directory where htslib caches the reference sequences
+        threads -- number of decompression threads
+    '''
+    if not bam.endswith(".cram"):
+        return pysam.AlignmentFile(bam,"rb",threads=threads)
+    if reference is None:
+        raise ValueError(bam+": a fasta reference (-ref) is needed for cram files")
+    # REF_PATH without url: htslib never downloads the reference sequences
+    cache = ref_cache if ref_cache is not None else os.path.join(os.path.expanduser("~"),".cache","hts-ref")
+    os.environ["REF_CACHE"] = os.path.join(cache,"%2s","%2s","%s")
+    os.environ["REF_PATH"] = os.environ["REF_CACHE"]
+    samfile = pysam.AlignmentFile(bam,"rc",reference_filename=reference,threads=threads,
+                                  format_options=[("required_fields="+str(CRAM_FIELDS)).encode()])
+    if ref_cache is not None:
+        # the sequences are only needed once the reads are decoded :
+        SQ = samfile.header.to_dict().get("SQ",[])
+        md5s = {sq["SN"] : sq["M5"] for sq in SQ} if all(["M5" in sq for sq in SQ]) and SQ != [] else None
+        populate_ref_cache(reference,ref_cache,md5s)
+    return samfile
+
+
+def open_libraries(bams,hts={}):
+    '''
+        Returns a samfile for each bam file and a thread pool with a thread
+        for each of them.
+
+        bams -- list of bam or cram files
+        hts -- dict of options of open_alignment() (reference,ref_cache,threads)
+    '''
+    samfiles = [open_alignment(bam,**hts) for bam in bams]
+    return samfiles,ThreadPoolExecutor(max_workers=len(bams))
+
+
+def library_names(bams):
+    '''
+        Returns a worksheet name for each bam file (at most 31 characters).
+
+        bams -- list of bam files
+    '''
+    names = []
+    for (i,bam) in enumerate(bams):
+        name = os.path.basename(bam)
+        for c in "[]:*?/\\":
+            name = name.replace(c,"_")
+        names.append((str(i+1)+"_"+name)[:31])
+    return names
+
+
+def query(pool,func,samfiles,caches,*args,**kwargs):
+    '''
+        Returns func(samfile,*args,cache=cache,**kwargs) for each library, the
+        libraries being queried concurrently (list).
+        Each samfile is only used by one thread at a time.
+
+        pool -- thread pool from open_libraries()
+        func -- function (get_all_Bx...)
+        samfiles -- list of samfiles
+        caches -- list of RegionCache objects (or None) for each samfile
+    '''
+    futures = [pool.submit(func,samfiles[i],*args,cache=caches[i],**kwargs) for i in range(len(samfiles))]
+    return [f.result() for f in futures]
+
+
+def namespace(S):
+    '''
+        Returns the union of the barcode sets of several libraries, each barcode
+        being tagged with its library so that barcodes of different libraries
+        never collide (set of (library,bx)).
+
+        S -- list of sets, one for each library
+    '''
+    pooled = set()
+    for (i,bxs) in enumerate(S):
+        pooled.update([(i,bx) for bx in bxs])
+    return pooled
+
+
+def add_worksheets(workbook,bams,source=None):
+    '''
+        Returns the worksheets of the results: a single one for one library,
+        else one for the pooled libraries followed by one for each library.
+
+        workbook -- xlsxwriter workbook
+        bams -- list of bam files
+        source -- name of the vcf file, prefix of the worksheets (None for none)
+    '''
+    if source is None:
+        if len(bams) == 1:
+            return [workbook.add_worksheet()]
+        return [workbook.add_worksheet("pooled")] + [workbook.add_worksheet(name) for name in library_names(bams)]
+    if len(bams) == 1:
+        return [workbook.add_worksheet(source)]
+    return [workbook.add_worksheet(source+"_pooled")] + [workbook.add_worksheet((source+"_"+name)[:31]) for name in library_names(bams)]
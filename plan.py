@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Query plan of several vcf files (callsets, SV types) evaluated at once.
+"""
+
+
+import os
+from events import get_events
+from stream import sorted_events
+from readers import open_text
+
+
+def get_sources(vcfs):
+    '''
+        Returns the names and the files of the vcf files (two lists).
+        A vcf file is given as file or as name=file; its default name is
+        its index followed by the file name without extension.
+
+        vcfs -- list of vcf files
+    '''
+    names = []
+    files = []
+    for (i,vcf) in enumerate(vcfs):
+        if "=" in vcf and not os.path.exists(vcf):
+            name,vcf = vcf.split("=",1)
+        else:
+            name = str(i+1)+"_"+os.path.basename(vcf).split(".")[0]
+        for c in "[]:*?/\\":
+            name = name.replace(c,"_")
+        # leaves room in the worksheet names for the library or "_null" :
+        names.append(name[:24])
+        files.append(vcf)
+    if len(set(names)) != len(names):
+        raise ValueError("the names of the vcf files are not unique: "+" ".join(names))
+    return names,files
+
+
+def get_plan(files,sort=False):
+    '''
+        Returns the regions of each vcf file, in the order of the file (list
+        of lists of (chrom,start,end)), and the regions to evaluate: those of
+        all the files, once each, sorted by chromosome and position (list).
+
+        files -- list of vcf files
+        sort -- boolean, sorts the variants of the files and groups the BND mates first (unsorted vcf files)
+    '''
+    E = []
+    for vcf in files:
+        with open_text(vcf) as filin:
+            events = sorted_events(filin) if sort else get_events(filin)
+            E.append([tuple(region) for (regions,clean) in events for region in regions])
+    plan = sorted(set([region for regions in E for region in regions]))
+    print(len(files),"vcf files,",sum([len(regions) for regions in E]),"regions,",len(plan),"to evaluate")
+    return E,plan
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Opening of text files (vcf, truth, bci) that may be gzip, bgzip or zstd compressed.
+"""
+
+
+import gzip, io, shutil, subprocess
+
+BUFFER = 1 << 20 # size of the chunks read from the files
+THREADS = 4      # number of decompression threads
+
+try:
+    from isal import igzip # faster gzip decompression, if installed
+except ImportError:
+    igzip = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class Pipe(io.TextIOWrapper):
+    '''
+        Text output of a decompression process, waited for when closed.
+        Raises OSError when closed if the process failed (truncated or
+        corrupted file).
+
+        proc -- subprocess.Popen object
+        file -- compressed file
+    '''
+    def __init__(self,proc,file):
+        super().__init__(io.BufferedReader(proc.stdout,BUFFER),encoding="utf-8")
+        self.proc = proc
+        self.file = file
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.proc.wait()
+        # a negative code is a signal: SIGPIPE when closed before the end of the file
+        if self.proc.returncode > 0:
+            raise OSError(self.file+": "+self.proc.args[0]+" failed with code "+str(self.proc.returncode)+" (truncated or corrupted file)")
+
+
+def get_format(file):
+    '''
+        Returns "gzip" (also bgzip), "zstd" or "text" from the first bytes
+        of a file.
+    '''
+    with open(file,"rb") as filin:
+        magic = filin.read(4)
+    if magic[:2] == b"\x1f\x8b":
+        return "gzip"
+    if magic == b"\x28\xb5\x2f\xfd":
+        return "zstd"
+    return "text"
+
+
+def open_text(file,threads=THREADS):
+    '''
+        Opens a text file for reading, decompressing it if needed.
+        bgzip/gzip files are decompressed by bgzip or pigz (several threads)
+        when installed, zstd files by zstd or the zstandard module.
+
+        file -- text, gzip, bgzip or zstd file
+        threads -- number of decompression threads
+    '''
+    f = get_format(file)
+    if f == "gzip":
+        if shutil.which("bgzip") is not None:
+            return Pipe(subprocess.Popen(["bgzip","-dc","-@",str(threads),file],stdout=subprocess.PIPE),file)
+        if shutil.which("pigz") is not None:
+            return Pipe(subprocess.Popen(["pigz","-dc","-p",str(threads),file],stdout=subprocess.PIPE),file)
+        if igzip is not None:
+            return io.TextIOWrapper(io.BufferedReader(igzip.open(file,"rb"),BUFFER),encoding="utf-8")
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(file,"rb"),BUFFER),encoding="utf-8")
+    if f == "zstd":
+        if shutil.which("zstd") is not None:
+            return Pipe(subprocess.Popen(["zstd","-dcq","-T"+str(threads),file],stdout=subprocess.PIPE),file)
+        if zstandard is not None:
+            reader = zstandard.ZstdDecompressor().stream_reader(open(file,"rb"),read_size=BUFFER,closefd=True)
+            return io.TextIOWrapper(io.BufferedReader(reader,BUFFER),encoding="utf-8")
+        raise ValueError(file+": zstd or the zstandard module is needed for zstd files")
+    return open(file,"r",buffering=BUFFER)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Writing of the results in results.xlsx, and in a tsv file that shard.py can merge.
+"""
+
+
+import hashlib
+from libraries import add_worksheets
+
+
+def sha256(file):
+    '''
+        Returns the sha256 checksum of a file.
+    '''
+    h = hashlib.sha256()
+    with open(file,"rb") as filin:
+        for chunk in iter(lambda: filin.read(1 << 20),b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def write_result(worksheet,row,cln,region,value):
+    '''
+        Writes a region and its value in the first free row of a column.
+
+        worksheet -- xlsxwriter worksheet
+        row -- list of the first free row of each column
+        cln -- column of the region (class of length, +2 for false variants)
+        region -- [chrom,start,end]
+        value -- int
+    '''
+    name = region[0]+":"+str(region[1])+"-"+str(region[2])
+    worksheet.write(row[cln],cln,name)
+    worksheet.write(row[cln],cln+1,value)
+    row[cln] += 1
+
+
+def write_values(filout,cln,region,values):
+    '''
+        Writes a region and its value in each worksheet in a tsv file.
+
+        filout -- tsv file (opened)
+        cln -- column of the region (class of length, +2 for false variants)
+        region -- [chrom,start,end]
+        values -- list of int, one for each worksheet
+    '''
+    name = region[0]+":"+str(region[1])+"-"+str(region[2])
+    filout.write(str(cln)+"\t"+name+"\t"+"\t".join([str(value) for value in values])+"\n")
+
+
+def open_tsv(file,vcf,worksheets):
+    '''
+        Opens a tsv file for write_values(), starting with the checksum of the
+        vcf file and the names of the worksheets.
+
+        file -- tsv file
+        vcf -- vcf file with variants
+        worksheets -- list of xlsxwriter worksheets of the results
+    '''
+    filout = open(file,"w")
+    filout.write("#vcf\t"+sha256(vcf)+"\n")
+    filout.write("#sheets\t"+"\t".join([worksheet.get_name() for worksheet in worksheets])+"\n")
+    return filout
+
+
+def close_tsv(filout,row,nb_rows=0):
+    '''
+        Ends a tsv file with its number of results, so that incomplete files
+        are detected.
+
+        filout -- tsv file (opened)
+        row -- list of the first free row of each column
+        nb_rows -- number of rows of tables written in the file
+    '''
+    filout.write("#end\t"+str(sum(row) + nb_rows)+"\n")
+    filout.close()
+
+
+def format_value(value):
+    '''
+        Returns a value of a table as a string of the tsv file.
+    '''
+    if value is None:
+        return ""
+    if isinstance(value,float):
+        return repr(float(value))
+    return str(value)
+
+
+def parse_value(s):
+    '''
+        Returns the value of a table from a string of the tsv file.
+    '''
+    if s == "":
+        return None
+    if s in ("True","False"):
+        return s == "True"
+    for t in (int,float):
+        try:
+            return t(s)
+        except ValueError:
+            pass
+    return s
+
+
+def write_table(workbook,name,titles,rows,filout=None):
+    '''
+        Adds a worksheet with a row of titles followed by rows of values
+        (None values are left empty).
+
+        workbook -- xlsxwriter workbook
+        name -- name of the worksheet
+        titles -- list of titles
+        rows -- list of lists of values
+        filout -- tsv file (opened) where the table is also written (None for none)
+    '''
+    worksheet = workbook.add_worksheet(name)
+    for (j,title) in enumerate(titles):
+        worksheet.write(0,j,title)
+    for (i,values) in enumerate(rows):
+        for (j,value) in enumerate(values):
+            if value is not None:
+                worksheet.write(i+1,j,value)
+    if filout is not None:
+        filout.write("#table\t"+name+"\t"+"\t".join(titles)+"\n")
+        for values in rows:
+            filout.write("#row\t"+name+"\t"+"\t".join([format_value(value) for value in values])+"\n")
+
+
+def read_tsv(file):
+    '''
+        Returns the checksum of the vcf file, the names of the worksheets,
+        the results (list of (cln,name,values)) and the tables (list of
+        (name,titles,rows)) of a tsv file. Raises ValueError if it is incomplete.
+
+        file -- tsv file from open_tsv()
+    '''
+    R = []
+    T = []
+    sheets = ["Sheet1"]
+    checksum = None
+    end = None
+    nb_rows = 0
+    with open(file,"r") as filin:
+        for line in filin:
+            line = line.rstrip("\n").split("\t")
+            if line[0] == "#vcf":
+                checksum = line[1]
+            elif line[0] == "#sheets":
+                sheets = line[1:]
+            elif line[0] == "#end":
+                end = int(line[1])
+            elif line[0] == "#table":
+                T.append((line[1],line[2:],[]))
+            elif line[0] == "#row":
+                T[-1][2].append([parse_value(value) for value in line[2:]])
+                nb_rows += 1
+            else:
+                R.append((int(line[0]),line[1],[int(value) for value in line[2:]]))
+    if checksum is None or end is None or end != len(R) + nb_rows:
+        raise ValueError(file+" is incomplete")
+    return checksum,sheets,R,T
+
+
+def write_sources(workbook,bams,names,files,E,V,out="results",tsv=False,tables=None):
+    '''
+        Writes the results of each vcf file in its own worksheets (the usual
+        worksheets for a single vcf file), in the order of the file.
+
+        workbook -- xlsxwriter workbook
+        bams -- list of bam files
+        names -- list of names of the vcf files, from plan.get_sources()
+        files -- list of vcf files
+        E -- list of the regions of each vcf file, from plan.get_plan()
+        V -- dict of (cln,values) for each region, values having one value by worksheet
+        out -- name of the results, without extension
+        tsv -- boolean, also writes the results of each vcf file in a tsv file (for shard.py)
+        tables -- list of (name,titles,rows) for each vcf file, added after the
+                  worksheets of all the vcf files (None for none)
+    '''
+    F = []
+    for (s,name) in enumerate(names):
+        if len(names) == 1:
+            worksheets = add_worksheets(workbook,bams)
+            filout = open_tsv(out+'.tsv',files[s],worksheets) if tsv else None
+        else:
+            worksheets = add_worksheets(workbook,bams,name)
+            filout = open_tsv(out+'_'+name+'.tsv',files[s],worksheets) if tsv else None
+        rows = [15 * [0] for worksheet in worksheets]
+        for region in E[s]:
+            cln,values = V[region]
+            for k in range(len(worksheets)):
+                write_result(worksheets[k],rows[k],cln,region,values[k])
+            if filout is not None:
+                write_values(filout,cln,region,values)
+        F.append((filout,rows[0]))
+    for (s,(filout,row)) in enumerate(F):
+        nb_rows = 0
+        if tables is not None:
+            for (name,titles,T) in tables[s]:
+                write_table(workbook,name,titles,T,filout)
+                nb_rows += len(T)
+        if filout is not None:
+            close_tsv(filout,row,nb_rows)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Splits a vcf file in shards run independently by work1, work2 or work3, and merges their results.
+"""
+
+
+import argparse, itertools, json, os, xlsxwriter
+from events import get_events
+from stream import sort_records
+from readers import open_text
+from results import sha256, write_result, write_table, read_tsv
+
+
+def get_cuts(vcf,n,sort=False):
+    '''
+        Returns the indexes of the variants starting each shard (list).
+        A shard only starts when no BND group is pending, so that each shard
+        gives the same results as in a single run.
+
+        vcf -- vcf file with variants
+        n -- number of shards
+        sort -- boolean, indexes of the sorted variants (unsorted vcf files)
+    '''
+    clean = [True]
+    with open_text(vcf) as filin:
+        for (regions,c) in get_events(sort_records(filin) if sort else filin):
+            clean.append(c)
+    total = len(clean) - 1
+    cuts = [0]
+    for k in range(1,n):
+        i = max((k * total) // n,cuts[-1] + 1)
+        while i < total and not clean[i]:
+            i += 1
+        if i < total:
+            cuts.append(i)
+    return cuts,total
+
+
+def split(vcf,n,prefix,sort=False):
+    '''
+        Writes the shards prefix_<i>.vcf and the manifest prefix.json.
+        With sort, the shards hold the sorted variants, so that the BND
+        variants grouped by a single run with -sort are in the same shard;
+        the shards are then run without -sort.
+
+        vcf -- vcf file with variants
+        n -- number of shards
+        prefix -- name of the shards, without extension
+        sort -- boolean, sorts the variants first (unsorted vcf files)
+    '''
+    cuts,total = get_cuts(vcf,n,sort)
+    cuts.append(total)
+    head = []
+    shards = []
+    with open_text(vcf) as filin:
+        line = filin.readline()
+        while line.startswith('#'):
+            head.append(line)
+            line = filin.readline()
+        if sort:
+            lines = sort_records(itertools.chain([line],filin))
+        else:
+            lines = itertools.chain([line],filin)
+        for k in range(len(cuts) - 1):
+            name = prefix+"_"+str(k)
+            with open(name+".vcf","w") as filout:
+                filout.writelines(head)
+                filout.writelines(itertools.islice(lines,cuts[k+1] - cuts[k]))
+            shards.append({"vcf" : name+".vcf",
+                           "sha256" : sha256(name+".vcf"),
+                           "variants" : cuts[k+1] - cuts[k],
+                           "results" : name+".tsv"})
+            print(name+".vcf",cuts[k+1] - cuts[k],"variants")
+    manifest = {"vcf" : os.path.abspath(vcf),
+                "sha256" : sha256(vcf),
+                "variants" : total,
+                "sort" : sort,
+                "shards" : shards}
+    with open(prefix+".json","w") as filout:
+        json.dump(manifest,filout,indent=4)
+
+
+def merge(manifest,out):
+    '''
+        Checks that all the shards of a manifest were run on unchanged shards,
+        and writes their results in out.xlsx, as a single run would (the
+        tables, as the null model of work3, included).
+
+        manifest -- json file from split()
+        out -- name of the results, without extension
+    '''
+    with open(manifest,"r") as filin:
+        M = json.load(filin)
+    # paths of the shards are relative to the manifest :
+    base = os.path.dirname(os.path.abspath(manifest))
+    R = []
+    T = None
+    S = None
+    for shard in M["shards"]:
+        vcf = os.path.join(base,os.path.basename(shard["vcf"]))
+        tsv = os.path.join(base,os.path.basename(shard["results"]))
+        if sha256(vcf) != shard["sha256"]:
+            raise ValueError(vcf+" was modified since split")
+        if not os.path.exists(tsv):
+            raise ValueError(tsv+" is missing")
+        checksum,sheets,results,tables = read_tsv(tsv)
+        if checksum != shard["sha256"]:
+            raise ValueError(tsv+" was not computed from "+vcf)
+        R.extend(results)
+        if S is None:
+            S = sheets
+            T = tables
+        elif S != sheets or [(name,titles) for (name,titles,rows) in T] != [(name,titles) for (name,titles,rows) in tables]:
+            raise ValueError(tsv+" was not computed with the same options as the other shards")
+        else:
+            for (t,(name,titles,rows)) in zip(T,tables):
+                t[2].extend(rows)
+    workbook = xlsxwriter.Workbook(out+'.xlsx')
+    # the worksheets of a single run: one for each library (and the pooled one) :
+    worksheets = [workbook.add_worksheet(name) for name in S]
+    rows = [15 * [0] for worksheet in worksheets]
+    for (cln,name,values) in R:
+        chrom,pos = name.rsplit(":",1)
+        start,end = pos.split("-",1)
+        for k in range(len(worksheets)):
+            write_result(worksheets[k],rows[k],cln,[chrom,start,end],values[k])
+    for (name,titles,rows) in T:
+        write_table(workbook,name,titles,rows)
+    workbook.close()
+    print(len(M["shards"]),"shards,",len(R),"results")
+
+####################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shards of a vcf file')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('split', help='Splits a vcf file in shards')
+    p.add_argument('-vcf', type=str, required=True, help='vcf file')
+    p.add_argument('-n', type=int, required=True, help='Number of shards')
+    p.add_argument('-o', type=str, default='shard', help='Name of the shards and of the manifest, without extension')
+    p.add_argument('-sort', action='store_true', help='Sorts the variants first (unsorted vcf files run with -sort); the shards are run without -sort')
+    p = sub.add_parser('merge', help='Merges the results of the shards')
+    p.add_argument('-manifest', type=str, required=True, help='json manifest from split')
+    p.add_argument('-o', type=str, default='results', help='Name of the results, without extension')
+    args = parser.parse_args()
+    if args.command == 'split':
+        split(args.vcf,args.n,args.o,args.sort)
+    else:
+        merge(args.manifest,args.o)
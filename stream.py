@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+    Events of unsorted vcf files: external merge sort of the variants before the BND variants are grouped.
+"""
+
+
+import heapq, tempfile
+from events import get_events
+
+CHUNK = 500000 # number of variants sorted in memory at once
+
+
+def get_key(line,ranks):
+    '''
+        Returns the sort key of a variant: rank of its chromosome and position.
+
+        line -- line of a vcf file
+        ranks -- dict of the rank of each chromosome
+    '''
+    c = line.split('\t',2)
+    return (ranks[c[0]],int(c[1]))
+
+
+def write_chunk(T,key,tmpdir=None):
+    '''
+        Returns a temporary file containing the sorted variants of a chunk,
+        ready to be read.
+
+        T -- list of lines of a vcf file
+        key -- sort key of the lines
+        tmpdir -- directory of the temporary files (None for the default one)
+    '''
+    T.sort(key=key)
+    f = tempfile.TemporaryFile("w+",dir=tmpdir)
+    f.writelines(T)
+    f.seek(0)
+    return f
+
+
+def sort_records(filin,chunk=CHUNK,tmpdir=None):
+    '''
+        Yields the variants of a vcf file sorted by chromosome and position,
+        with at most chunk variants in memory: sorted chunks are written in
+        temporary files, then merged.
+        The chromosomes keep the order in which they first appear in the file,
+        so a sorted file is yielded unchanged.
+
+        filin -- vcf file (opened)
+        chunk -- number of variants sorted in memory at once
+        tmpdir -- directory of the temporary files (None for the default one)
+    '''
+    ranks = {}
+    key = lambda line: get_key(line,ranks)
+    files = []
+    T = []
+    for line in filin:
+        if line.startswith('#') or line.strip() == "":
+            continue
+        ranks.setdefault(line.split('\t',1)[0],len(ranks))
+        T.append(line.rstrip("\n")+"\n")
+        if len(T) == chunk:
+            files.append(write_chunk(T,key,tmpdir))
+            T = []
+    # the whole file fits in memory :
+    if files == []:
+        T.sort(key=key)
+        yield from T
+        return
+    if T != []:
+        files.append(write_chunk(T,key,tmpdir))
+    try:
+        yield from heapq.merge(*files,key=key)
+    finally:
+        for f in files:
+            f.close()
+
+
+def sorted_events(filin,chunk=CHUNK,tmpdir=None):
+    '''
+        Yields, as events.get_events(), the regions of the variants of an
+        unsorted vcf file, in the order of the genome.
+        The sorted variants are grouped by events.get_events(): the BND
+        variants between the same chromosomes follow each other as in a
+        sorted file, and a sorted file gives the same events as without
+        sorting.
+
+        filin -- vcf file (opened)
+        chunk -- number of variants sorted in memory at once
+        tmpdir -- directory of the temporary files (None for the default one)
+    '''
+    return get_events(sort_records(filin,chunk,tmpdir))
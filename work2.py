@@ -6,11 +6,19 @@
 """
 
 
-import argparse, pysam, xlsxwriter
+import argparse, json, xlsxwriter
 from statistics import mean
-from Variant import Variant
+from RegionCache import RegionCache
+from Blacklist import Blacklist
+from ReadFilter import ReadFilter, FLAGS, fetch_reads
+from BarcodeIndex import BarcodeIndex
+from readers import open_text
+from plan import get_sources, get_plan
+from results import write_sources
+from libraries import open_libraries, query
 
 N_GAP = 5000     # space allowed between linked-reads in cluster
+MIN_READS = 6    # number of linked-reads in a cluster
 L_SV = [2000,10000] # lengths for variants
 
 
@@ -22,7 +30,7 @@ def trueSV(file):
         file -- file
     '''
     truth = []
-    with open(file,"r") as filin:
+    with open_text(file) as filin:
         line = filin.readline()
         while line != '':
             sv = line.split()
@@ -65,37 +73,7 @@ def isValid_bnd(variant,L,m):
     return False
 
 
-def get_chrom_bnd(v):
-    '''
-        Returns the chromosome name of a BND variant.
-        
-        v -- Variant object
-    '''
-    c = v.alt.split(':')
-    if '[' in c[0]:
-        c = c[0].split('[')
-        return c[1]
-    else:
-        c = c[0].split(']')
-        return c[1]
-
-
-def get_pos_bnd(v):
-    '''
-        Returns the position in ALT attribute of a BND variant.
-        
-        v -- Variant object
-    '''
-    c = v.alt.split(':')
-    try:
-        c = c[1].split(']')
-        return int(c[0])
-    except ValueError:
-        c = c[0].split('[')
-        return int(c[0])
-    
-    
-def get_all_Bx(file,chrom,start,end):
+def get_all_Bx(file,chrom,start,end,cache=None,blacklist=None,filters=None):
     '''
         Returns all the barcodes and their position from a region (set).
         
@@ -103,20 +81,36 @@ def get_all_Bx(file,chrom,start,end):
         chrom -- chromosome name
         start -- region's start position
         end -- region's end position
+        cache -- RegionCache object (None to always fetch the region)
+        blacklist -- Blacklist object, its barcodes are skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
     '''
     all_bx = set()
+    skipped = []
     if start > end:
         start1 = end
         end1 = start
     else:
         start1 = start
         end1 = end
-    for read in file.fetch(chrom,start1,end1):
-        if read.has_tag('BX'):
-            bx = read.get_tag('BX')
-            bx = bx[:-2]
-            pos = read.reference_start
-            all_bx.add((bx,pos))
+    if cache is not None:
+        for (pos,b,bx) in cache.fetch(file,chrom,start1,end1,filters):
+            if blacklist is not None and bx in blacklist:
+                skipped.append(bx)
+            else:
+                all_bx.add((bx[:-2],pos))
+    else:
+        for read in fetch_reads(file,filters,chrom,start1,end1):
+            if read.has_tag('BX'):
+                bx = read.get_tag('BX')
+                if blacklist is not None and bx in blacklist:
+                    skipped.append(bx)
+                    continue
+                bx = bx[:-2]
+                pos = read.reference_start
+                all_bx.add((bx,pos))
+    if blacklist is not None:
+        blacklist.count(len(skipped),set(skipped))
     return all_bx
 
 
@@ -192,18 +186,18 @@ def partition(D,bx,c,gap=N_GAP):
     return P
     
  
-def clean_P(P):
+def clean_P(P,n=MIN_READS):
     '''
         Removes all the clusters that do not have at least n barcodes.
 
         P -- list from partition()
+        n -- int (see bcistats.py for a dataset-specific value)
     '''
     # calculation of the mean :
     #M = []
     #for [a,b,c] in P:
     #    M.append(c)
     #n = mean(M)
-    n = 6
     # removes short clusters :
     F = []
     for [a,b,c] in P:
@@ -212,17 +206,30 @@ def clean_P(P):
     return F
 
 
-def store_bx(bci):
+def load_profile(file):
+    '''
+        Returns N_GAP and MIN_READS from a json profile made by bcistats.py.
+
+        file -- json file
+    '''
+    with open(file,"r") as filin:
+        P = json.load(filin)
+    return P["N_GAP"],P["MIN_READS"]
+
+
+def store_bx(bci,blacklist=None):
     '''
         Reads a file and stores the barcodes in a dict.
 
         bci -- file, each line is as bx;chrom:pos:length
+        blacklist -- Blacklist object, its barcodes are not stored (None for none)
     '''
     D = {}
-    with open(bci,"r") as filin:
+    with open_text(bci) as filin:
         for line in filin:
             line = line.rstrip().split(";")
-            D[line[0]] = line[1]
+            if blacklist is None or line[0] not in blacklist:
+                D[line[0]] = line[1]
     return D
 
 
@@ -233,158 +240,139 @@ def forTest(L):
     return R
 
 
-def nb_isolated(L,bci,D,c):
+def nb_isolated(L,bci,D,c,gap=N_GAP,n=MIN_READS):
     '''
         Returns the number of isolated barcodes.
     
         L -- set of barcodes
         D -- dict resulting from store_bx()
+        gap -- space allowed between linked-reads in cluster
+        n -- number of linked-reads in a cluster
     '''
     cpt = 0
     #with open("partitions.txt","a") as test:
     for (bx,pos) in L:
-        P = partition(D,bx,c)
+        P = partition(D,bx,c,gap)
         #T = forTest(P)
         #test.write("\n"+str(T))
-        P = clean_P(P)
-        if isIsolated(pos,P):
+        P = clean_P(P,n)
+        if isIsolated(pos,P,gap):
             cpt += 1
     return cpt
 
 
-def sortSV(vcf,bam,bci,truth,margin):
+def get_cln(length):
+    '''
+        Returns the first column of the class of length of a variant.
+
+        length -- variant's length
+    '''
+    if length < L_SV[0]:
+        return 0
+    if length < L_SV[1]:
+        return 6
+    return 12
+
+
+def sortSV(vcfs,bams,bcis,truth,margin,cache_size=0,profile=None,out="results",tsv=False,hts={},blacklist=None,index=False,filters=None,sort=False):
     '''
         Creates results.xlsx containing the number of barcodes for real
         variants and false one.
+        With several bam files, a worksheet for the pooled libraries is
+        followed by a worksheet for each library.
+        With several vcf files, their regions are evaluated once, in the
+        order of the genome, and each vcf file has its own worksheets.
         
-        vcf -- vcf file with variants
-        bam -- bam file with reads mapping in the genome reference
-        bci -- bci file got by LRez
+        vcfs -- list of vcf files with variants (file or name=file)
+        bams -- list of bam files with reads mapping in the genome reference
+        bcis -- list of bci files got by LRez, one for each bam file
         truth -- file with real variants
         margin -- boolean
+        cache_size -- memory budget of the region cache in MB (0 for no cache)
+        profile -- json profile made by bcistats.py (None for N_GAP and MIN_READS)
+        out -- name of the results, without extension
+        tsv -- boolean, also writes the results in out.tsv, or out_<name>.tsv for each vcf file (for shard.py)
+        hts -- dict of options to open the bam/cram files (see libraries.open_alignment())
+        blacklist -- file of barcodes skipped by the metric (None for none)
+        index -- boolean, reads the barcodes of the bci files on demand (BarcodeIndex) instead of storing all of them
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+        sort -- boolean, sorts the variants of the vcf files and groups the BND mates first (unsorted vcf files)
     '''
-    cpt = 1
-    row = 15 * [0]
-    L = []
+    B = Blacklist(blacklist) if blacklist is not None else None
+    gap,n = load_profile(profile) if profile is not None else (N_GAP,MIN_READS)
     m = 100 if margin else 0
     realSV = trueSV(truth)
-    samfile = pysam.AlignmentFile(bam,"rb")
-    workbook = xlsxwriter.Workbook('results.xlsx')
-    worksheet = workbook.add_worksheet()
-    D = store_bx(bci)
-    # Used to store current chromosomes for BND, and to output BND when changing chromosome
-    curChr1 = ""
-    curChr2 = ""
-    with open(vcf,"r") as filin:
-        # skips file's head :
-        line = filin.readline()
-        while line.startswith('#'):
-            line = filin.readline()
-        # for each variant :
-        while line != '':
-            v = Variant(line)
-            print("variant",cpt)
-            cpt += 1
-            # We keep filling L if both chromosomes correspond to current one
-            # If not, this means we're not processing the same variant anymore, so we treat the BND we've read so far
-            if v.get_svtype() == "BND" and ((curChr1 == "" and curChr2 == "") or (curChr1 == v.chrom and curChr2 == get_chrom_bnd(v))):
-                if L ==[]:
-                    L.append([v.chrom,v.pos,-1])
-                    L.append([get_chrom_bnd(v),get_pos_bnd(v),-1])
-                    curChr1 = v.chrom
-                    curChr2 = get_chrom_bnd(v)
-                else:
-                    if v.pos > L[0][2]:
-                        L[0][2] = v.pos
-                    if get_pos_bnd(v) > L[1][2]:
-                        L[1][2] = get_pos_bnd(v)
-            else:
-                # we treat the BND variants :
-                if L != [] and L[0][2] != -1 and L[1][2] != -1:
-                    all_Bx = get_all_Bx(samfile,L[0][0],L[0][1],L[0][2])
-                    all_Bx_pair = get_all_Bx(samfile,L[1][0],L[1][1],L[1][2])
-                    # first BND variant is valid :
-                    if L[0][2] - L[0][1] < L_SV[0]:
-                    		cln = 0
-                    if L_SV[0] <= L[0][2] - L[0][1] < L_SV[1]:
-                    		cln = 6
-                    if L[0][2] - L[0][1] >= L_SV[1]:
-                    		cln = 12
-                    if isValid_bnd(L[0],realSV,m):
-                        worksheet.write(row[cln],cln,L[0][0]+":"+str(L[0][1])+"-"+str(L[0][2]))
-                        worksheet.write(row[cln],cln+1,nb_isolated(all_Bx,bci,D,L[0][0]))
-                        row[cln] += 1
-                    # first BND variant is not valid :
-                    else:
-                        worksheet.write(row[cln+2],cln+2,L[0][0]+":"+str(L[0][1])+"-"+str(L[0][2]))
-                        worksheet.write(row[cln+2],cln+3,nb_isolated(all_Bx,bci,D,L[0][0]))
-                        row[cln+2] += 1
-                    # second BND variant is valid :
-                    if L[1][2] - L[1][1] < L_SV[0]:
-                    		cln = 0
-                    if L_SV[0] <= L[1][2] - L[1][1] < L_SV[1]:
-                    		cln = 6
-                    if L[1][2] - L[1][1] >= L_SV[1]:
-                    		cln = 12
-                    if isValid_bnd(L[1],realSV,m):
-                        worksheet.write(row[cln],cln,L[1][0]+":"+str(L[1][1])+"-"+str(L[1][2]))
-                        worksheet.write(row[cln],cln+1,nb_isolated(all_Bx_pair,bci,D,L[1][0]))
-                        row[cln] += 1
-                    # second BND variant is not valid :
-                    else:
-                        worksheet.write(row[cln+2],cln+2,L[1][0]+":"+str(L[1][1])+"-"+str(L[1][2]))
-                        worksheet.write(row[cln+2],cln+3,nb_isolated(all_Bx_pair,bci,D,L[1][0]))
-                        row[cln+2] += 1
-                    L = []
-                    # Update current chromosomes and L if we read a BND, otherwise set them / leave them empty
-                    if v.get_svtype() == "BND":
-                        L.append([v.chrom,v.pos,-1])
-                        L.append([get_chrom_bnd(v),get_pos_bnd(v),-1])
-                        curChr1 = v.chrom
-                        curChr2 = get_chrom_bnd(v)
-                    else:
-                        curChr1 = ""
-                        curChr2 = ""
-                # treatment of a non BND variant :
-                # Only do if we didn't read a BND
-                if v.get_svtype() != "BND":
-                    end = v.get_end()
-                    all_Bx = get_all_Bx(samfile,v.chrom,v.pos,end)
-                    if end - v.pos < L_SV[0]:
-                    		cln = 0
-                    if L_SV[0] <= end - v.pos < L_SV[1]:
-                    		cln = 6
-                    if end - v.pos >= L_SV[1]:
-                    		cln = 12
-                    # variant is valid :
-                    if isValid(v,realSV,m):
-                        worksheet.write(row[cln],cln,v.chrom+":"+str(v.pos)+"-"+str(end))
-                        worksheet.write(row[cln],cln+1,nb_isolated(all_Bx,bci,D,v.chrom))
-                        row[cln] += 1
-                    # variant is not valid :
-                    else:
-                        worksheet.write(row[cln+2],cln+2,v.chrom+":"+str(v.pos)+"-"+str(end))
-                        worksheet.write(row[cln+2],cln+3,nb_isolated(all_Bx,bci,D,v.chrom))
-                        row[cln+2] += 1
-            line = filin.readline()
+    samfiles,pool = open_libraries(bams,hts)
+    caches = [RegionCache(cache_size * 1024 * 1024 // len(bams)) if cache_size > 0 else None for bam in bams]
+    if index:
+        D = [BarcodeIndex(bci) for bci in bcis]
+    else:
+        D = [store_bx(bci,B) for bci in bcis]
+    names,files = get_sources(vcfs)
+    E,plan = get_plan(files,sort)
+    V = {}
+    # for each region, in the order of the genome :
+    for (i,region) in enumerate(plan):
+        print("region",i+1,"/",len(plan))
+        S = query(pool,get_all_Bx,samfiles,caches,region[0],region[1],region[2],blacklist=B,filters=filters)
+        # each library is partitioned with its own bci, so barcodes never collide :
+        nb = [nb_isolated(S[i],bcis[i],D[i],region[0],gap,n) for i in range(len(S))]
+        if len(S) > 1:
+            nb = [sum(nb)] + nb
+        cln = get_cln(region[2] - region[1])
+        # variant is not valid :
+        if not isValid_bnd(region,realSV,m):
+            cln += 2
+        V[region] = (cln,nb)
+    workbook = xlsxwriter.Workbook(out+'.xlsx')
+    write_sources(workbook,bams,names,files,E,V,out,tsv)
     workbook.close()
-    samfile.close()
+    pool.shutdown()
+    for samfile in samfiles:
+        samfile.close()
+    for cache in caches:
+        if cache is not None:
+            print(cache.report())
+    if B is not None:
+        print(B.report())
+    if filters is not None:
+        print(filters.report())
+    if index:
+        for d in D:
+            print(d.report())
+            d.close()
     
 
 ####################################################
 
 
 parser = argparse.ArgumentParser(description='Sort SV')
-parser.add_argument('-vcf', type=str, required=True, help='vcf file')
-parser.add_argument('-bam', type=str, required=True, help='bam file')
-parser.add_argument('-bci', type=str, required=True, help='bci file got by LRez')
+parser.add_argument('-vcf', type=str, nargs='+', required=True, help='vcf file(s), as file or name=file, evaluated at once')
+parser.add_argument('-bam', type=str, nargs='+', required=True, help='bam file(s), queried concurrently')
+parser.add_argument('-bci', type=str, nargs='+', required=True, help='bci file(s) got by LRez, one for each bam file')
 parser.add_argument('-t', type=str, required=True, help='Truth file')
 parser.add_argument('-m', action='store_true', help="Allows a margin to increase variants's length")
+parser.add_argument('-profile', type=str, default=None, help='json profile made by bcistats.py (N_GAP and MIN_READS)')
+parser.add_argument('-o', type=str, default='results', help='Name of the results, without extension')
+parser.add_argument('-tsv', action='store_true', help='Also writes the results in a tsv file (for shard.py)')
+parser.add_argument('-ref', type=str, default=None, help='fasta file of the genome reference (needed for cram files)')
+parser.add_argument('-ref_cache', type=str, default=None, help='Local cache of the reference sequences for cram files')
+parser.add_argument('-threads', type=int, default=1, help='Number of decompression threads for each bam/cram file')
+parser.add_argument('-sort', action='store_true', help='Sorts the variants and groups the BND mates first (unsorted vcf files)')
+parser.add_argument('-mapq', type=int, default=0, help='Minimal mapping quality of the reads')
+parser.add_argument('-filter', type=str, nargs='+', default=[], choices=list(FLAGS), help='Kinds of reads skipped (flag bits)')
+parser.add_argument('-blacklist', type=str, default=None, help='File of barcodes skipped by the metric (made by bcistats.py)')
+parser.add_argument('-index', action='store_true', help='Reads the barcodes of the bci file on demand through a sorted index (bci.bcx) instead of storing all of them')
+parser.add_argument('-cache', type=int, default=0, help='Memory budget of the region cache in MB (0 for no cache)')
 args = parser.parse_args()
+if len(args.bci) != len(args.bam):
+    parser.error("-bci needs one file for each bam file")
 
 if __name__ == '__main__':
+    hts = {"reference" : args.ref, "ref_cache" : args.ref_cache, "threads" : args.threads}
+    F = ReadFilter(args.mapq,args.filter) if args.mapq > 0 or args.filter != [] else None
     if args.m:
-        sortSV(args.vcf,args.bam,args.bci,args.t,True)
+        sortSV(args.vcf,args.bam,args.bci,args.t,True,args.cache,args.profile,args.o,args.tsv,hts,args.blacklist,args.index,F,args.sort)
     else:
-        sortSV(args.vcf,args.bam,args.bci,args.t,False)
+        sortSV(args.vcf,args.bam,args.bci,args.t,False,args.cache,args.profile,args.o,args.tsv,hts,args.blacklist,args.index,F,args.sort)
     
@@ -6,10 +6,22 @@
 """
 
 
-import argparse, pysam, xlsxwriter
+import argparse, xlsxwriter, zlib
+import numpy as np
+from scipy import sparse
 from Variant import Variant
+from RegionCache import RegionCache
+from Blacklist import Blacklist
+from ReadFilter import ReadFilter, FLAGS, fetch_reads
+from readers import open_text
+from events import get_chrom_bnd, get_pos_bnd
+from plan import get_sources, get_plan
+from results import write_sources
+from libraries import open_alignment, open_libraries, query, namespace
 
 GAP = 500
+NULL_PAIRS = 100000 # pairs of windows of the null model computed at once
+NULL_TRIES = 20     # draws of the random pairs of a variant before it is left without null model
 L_SV = [2000,10000] # lengths for variants
 
 
@@ -22,7 +34,7 @@ def trueSV(file):
         file -- file
     '''
     truth = []
-    with open(file,"r") as filin:
+    with open_text(file) as filin:
         line = filin.readline()
         while line != '':
             sv = line.split()
@@ -65,7 +77,7 @@ def isValid_bnd(variant,L,m):
     return False
 
 
-def get_all_Bx(file,chrom,start,end):
+def get_all_Bx(file,chrom,start,end,cache=None,blacklist=None,filters=None):
     '''
         Returns all the barcodes from a region (set).
         
@@ -73,8 +85,12 @@ def get_all_Bx(file,chrom,start,end):
         chrom -- chromosome name
         start -- region's start position
         end -- region's end position
+        cache -- RegionCache object (None to always fetch the region)
+        blacklist -- Blacklist object, its barcodes are skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
     '''
     all_bx = set()
+    skipped = []
     if start < 0:
         start = 0
     if start > end:
@@ -83,11 +99,23 @@ def get_all_Bx(file,chrom,start,end):
     else:
         start1 = start
         end1 = end
-    for read in file.fetch(chrom,start1,end1):
-        if read.has_tag('BX'):
-            bx = read.get_tag('BX')
-            bx = bx[:-2]
-            all_bx.add(bx)
+    if cache is not None:
+        for (a,b,bx) in cache.fetch(file,chrom,start1,end1,filters):
+            if blacklist is not None and bx in blacklist:
+                skipped.append(bx)
+            else:
+                all_bx.add(bx[:-2])
+    else:
+        for read in fetch_reads(file,filters,chrom,start1,end1):
+            if read.has_tag('BX'):
+                bx = read.get_tag('BX')
+                if blacklist is not None and bx in blacklist:
+                    skipped.append(bx)
+                    continue
+                bx = bx[:-2]
+                all_bx.add(bx)
+    if blacklist is not None:
+        blacklist.count(len(skipped),set(skipped))
     return all_bx
 
 
@@ -102,171 +130,580 @@ def intersection(S1,S2):
     return res
 
 
-def get_chrom_bnd(v):
+def breakpoint_windows(vcfs,gap=GAP):
     '''
-        Returns the chromosome name of a BND variant.
-        
-        v -- Variant object
+        Returns the windows around every breakpoint of vcf files, by chromosome
+        (dict of sorted lists of [start,end]).
+
+        vcfs -- list of vcf files with variants
+        gap -- half size of a window
     '''
-    c = v.alt.split(':')
-    if '[' in c[0]:
-        c = c[0].split('[')
-        return c[1]
-    else:
-        c = c[0].split(']')
-        return c[1]
+    W = {}
+    for vcf in vcfs:
+        with open_text(vcf) as filin:
+            for line in filin:
+                if line.startswith('#'):
+                    continue
+                v = Variant(line)
+                if v.get_svtype() == "BND":
+                    bkp = [(v.chrom,v.pos),(get_chrom_bnd(v),get_pos_bnd(v))]
+                else:
+                    bkp = [(v.chrom,v.pos),(v.chrom,v.get_end())]
+                for (chrom,pos) in bkp:
+                    W.setdefault(chrom,set()).add((max(pos-gap,0),pos+gap))
+    return {chrom : sorted([list(w) for w in S]) for chrom,S in W.items()}
 
 
-def get_pos_bnd(v):
+def incidence(files,chrom,windows,blacklist=None,filters=None):
     '''
-        Returns the position in ALT attribute of a BND variant.
-        
-        v -- Variant object
+        Returns the sparse barcode x window incidence matrix of a chromosome
+        (csr matrix, 1 if the barcode has a read in the window).
+        Overlapping windows are fetched together, so each read is decoded once.
+
+        files -- list of samfiles (barcodes of different files never collide)
+        chrom -- chromosome name
+        windows -- sorted list of [start,end] from breakpoint_windows()
+        blacklist -- Blacklist object, its barcodes are skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+    '''
+    ids = {}
+    rows = []
+    cols = []
+    skipped = []
+    i = 0
+    while i < len(windows):
+        # cluster of overlapping windows :
+        j = i + 1
+        end = windows[i][1]
+        while j < len(windows) and windows[j][0] < end:
+            end = max(end,windows[j][1])
+            j += 1
+        rs = []
+        re = []
+        bxs = []
+        for (l,file) in enumerate(files):
+            for read in fetch_reads(file,filters,chrom,windows[i][0],end,stage="windows"):
+                if read.has_tag('BX'):
+                    bx = read.get_tag('BX')
+                    if blacklist is not None and bx in blacklist:
+                        skipped.append(bx)
+                        continue
+                    bx = bx[:-2]
+                    bx = (l,bx)
+                    rs.append(read.reference_start)
+                    re.append(read.reference_end if read.reference_end is not None else read.reference_start + 1)
+                    bxs.append(ids.setdefault(bx,len(ids)))
+        rs = np.array(rs,dtype=np.int64)
+        re = np.array(re,dtype=np.int64)
+        bxs = np.array(bxs,dtype=np.int64)
+        # same overlap rule as fetch() for each window of the cluster :
+        for k in range(i,j):
+            bx = np.unique(bxs[(re > windows[k][0]) & (rs < windows[k][1])])
+            rows.append(bx)
+            cols.append(np.full(len(bx),k,dtype=np.int64))
+        i = j
+    if blacklist is not None:
+        blacklist.count(len(skipped),set(skipped))
+    rows = np.concatenate(rows) if rows != [] else np.zeros(0,dtype=np.int64)
+    cols = np.concatenate(cols) if cols != [] else np.zeros(0,dtype=np.int64)
+    data = np.ones(len(rows),dtype=np.int32)
+    return sparse.csr_matrix((data,(rows,cols)),shape=(len(ids),len(windows)))
+
+
+def shared_matrix(A):
+    '''
+        Returns the number of barcodes in common between every pair of windows
+        (sparse window x window matrix, the diagonal is the number of barcodes
+        of each window).
+
+        A -- matrix from incidence()
+    '''
+    return (A.T @ A).tocoo()
+
+
+def top_links(S,windows,k,dist=None):
+    '''
+        Returns the k pairs of different windows sharing the most barcodes
+        (list of (window1,window2,nb_common), best first).
+
+        S -- matrix from shared_matrix()
+        windows -- list of [start,end] from breakpoint_windows()
+        k -- number of links to keep
+        dist -- maximal distance between two windows (None for no limit)
+    '''
+    starts = np.array([w[0] for w in windows],dtype=np.int64)
+    keep = (S.row < S.col) & (S.data > 0)
+    if dist is not None:
+        keep &= np.abs(starts[S.col] - starts[S.row]) <= dist
+    row = S.row[keep]
+    col = S.col[keep]
+    data = S.data[keep]
+    order = np.argsort(-data,kind="stable")[:k]
+    return [(windows[row[i]],windows[col[i]],int(data[i])) for i in order]
+
+
+def chrom_arrays(files,chrom,blacklist=None,filters=None):
+    '''
+        Returns the barcoded reads of a chromosome, read in one pass, as numpy
+        arrays (starts,ends,ids) sorted by start and the number of barcodes.
+
+        files -- list of samfiles (barcodes of different files never collide)
+        chrom -- chromosome name
+        blacklist -- Blacklist object, its barcodes are skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+    '''
+    ids = {}
+    starts = []
+    ends = []
+    bxs = []
+    skipped = []
+    for (l,file) in enumerate(files):
+        for read in fetch_reads(file,filters,chrom,stage="chromosomes"):
+            if read.has_tag('BX'):
+                bx = read.get_tag('BX')
+                if blacklist is not None and bx in blacklist:
+                    skipped.append(bx)
+                    continue
+                bx = bx[:-2]
+                bx = (l,bx)
+                starts.append(read.reference_start)
+                ends.append(read.reference_end if read.reference_end is not None else read.reference_start + 1)
+                bxs.append(ids.setdefault(bx,len(ids)))
+    if blacklist is not None:
+        blacklist.count(len(skipped),set(skipped))
+    starts = np.array(starts,dtype=np.int32)
+    order = np.argsort(starts,kind="stable")
+    return (starts[order],np.array(ends,dtype=np.int32)[order],np.array(bxs,dtype=np.int32)[order]),len(ids)
+
+
+def window_incidence(arrays,nb_bx,ws,we):
+    '''
+        Returns the sparse barcode x window incidence matrix of many windows
+        at once (csr matrix, 1 if the barcode has a read in the window).
+
+        arrays -- arrays from chrom_arrays()
+        nb_bx -- number of barcodes from chrom_arrays()
+        ws -- numpy array of windows' start positions
+        we -- numpy array of windows' end positions
+    '''
+    (starts,ends,ids) = arrays
+    longest = int((ends - starts).max()) if len(starts) > 0 else 0
+    lo = np.searchsorted(starts,ws - longest)
+    hi = np.searchsorted(starts,we)
+    n = hi - lo
+    # indexes of the reads starting in [ws - longest, we) for each window :
+    col = np.repeat(np.arange(len(ws)),n)
+    idx = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n,n) + np.repeat(lo,n)
+    keep = ends[idx] > ws[col]
+    A = sparse.csr_matrix((np.ones(keep.sum(),dtype=np.int32),(ids[idx[keep]],col[keep])),shape=(nb_bx,len(ws)))
+    A.data[:] = 1
+    return A
+
+
+def has_reads(arrays,reach,ws,we):
+    '''
+        Returns True for each window with at least one read (numpy array).
+
+        arrays -- arrays from chrom_arrays()
+        reach -- maximal end of the reads up to each read (cumulative maximum of the ends)
+        ws -- numpy array of windows' start positions
+        we -- numpy array of windows' end positions
+    '''
+    # last read starting before the end of the window, and the farthest end up to it :
+    j = np.searchsorted(arrays[0],we)
+    return (j > 0) & (reach[np.maximum(j - 1,0)] > ws)
+
+
+def null_common(arrays,reach,nb_bx,length,D,n,rngs,gap=GAP):
+    '''
+        Returns the number of common barcodes between n random pairs of
+        windows for each distance (numpy array, one row by distance) and the
+        number of pairs drawn again because a window had no read.
+        The pairs are on the same chromosome and at the same distance as the
+        variant, hence in the same length class, and both windows have reads:
+        uncovered stretches (gaps, centromeres) would add pairs without any
+        common barcode and lower the null model.
+
+        arrays -- arrays from chrom_arrays()
+        reach -- cumulative maximum of the ends of the reads, see has_reads()
+        nb_bx -- number of barcodes from chrom_arrays()
+        length -- chromosome's length
+        D -- list of distances between breakpoints
+        n -- number of random pairs by distance
+        rngs -- numpy random generator of each distance
+    '''
+    D = np.array(D,dtype=np.int64)
+    ok = D + 2 * gap < length
+    x = np.zeros((len(D),n),dtype=np.int64)
+    redrawn = 0
+    for i in np.flatnonzero(ok):
+        drawn = []
+        nb = 0
+        for t in range(NULL_TRIES):
+            c = rngs[i].integers(gap,length - D[i] - gap,size=n)
+            keep = has_reads(arrays,reach,c - gap,c + gap) & has_reads(arrays,reach,c + D[i] - gap,c + D[i] + gap)
+            redrawn += int((~keep).sum())
+            drawn.append(c[keep])
+            nb += int(keep.sum())
+            if nb >= n:
+                break
+        if nb < n:
+            ok[i] = False
+        else:
+            x[i] = np.concatenate(drawn)[:n]
+    x1 = x.ravel()
+    x2 = (x + D[:,None]).ravel()
+    A1 = window_incidence(arrays,nb_bx,x1 - gap,x1 + gap)
+    A2 = window_incidence(arrays,nb_bx,x2 - gap,x2 + gap)
+    common = np.asarray(A1.multiply(A2).sum(axis=0)).reshape(len(D),n).astype(float)
+    common[~ok] = np.nan
+    return common,redrawn
+
+
+def null_model(samfiles,R,n,seed,blacklist=None,filters=None):
+    '''
+        Returns the numbers of common barcodes of n random pairs of windows
+        with reads for each variant, as far apart as the variant (list of arrays).
+
+        samfiles -- list of samfiles (pooled)
+        R -- list of (chrom,start,end,nb_common) from sortSV()
+        n -- number of random pairs by variant
+        seed -- seed of the random generators
+        blacklist -- Blacklist object, its barcodes are skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+    '''
+    P = len(R) * [None]
+    redrawn = 0
+    for chrom in sorted(set([r[0] for r in R])):
+        I = [i for i in range(len(R)) if R[i][0] == chrom]
+        print("null model",chrom,len(I),"variants")
+        arrays,nb_bx = chrom_arrays(samfiles,chrom,blacklist,filters)
+        length = samfiles[0].get_reference_length(chrom)
+        reach = np.maximum.accumulate(arrays[1]) if len(arrays[1]) > 0 else arrays[1]
+        # variants by batches of about NULL_PAIRS pairs of windows, to bound the memory :
+        size = max(1,NULL_PAIRS // n)
+        for b in range(0,len(I),size):
+            # each variant has its own generator, so that its draws do not depend on the other variants (shards) :
+            rngs = [np.random.default_rng([seed,zlib.crc32(chrom.encode()),R[i][1],R[i][2]]) for i in I[b:b+size]]
+            common,r = null_common(arrays,reach,nb_bx,length,[abs(R[i][2] - R[i][1]) for i in I[b:b+size]],n,rngs)
+            redrawn += r
+            for (i,c) in zip(I[b:b+size],common):
+                P[i] = c
+    print("null model:",redrawn,"random pairs drawn again (window without reads),",sum([int(np.isnan(c).any()) for c in P]),"variants without null model")
+    return P
+
+
+NULL_TITLES = ["region","valid","nb_common","null_mean","null_sd","z_score","p_value"]
+
+
+def null_rows(R,P,realSV,m,n):
+    '''
+        Returns the rows of the worksheet of the null model (titles in
+        NULL_TITLES): the empirical p-value and z-score of the number of
+        common barcodes of each variant, against random pairs of windows.
+
+        R -- list of (chrom,start,end,nb_common) from sortSV()
+        P -- list from null_model(), in the order of R
+        realSV -- list from trueSV()
+        m -- int
+        n -- number of random pairs by variant
+    '''
+    rows = []
+    for (i,(chrom,start,end,nb_common)) in enumerate(R):
+        c = P[i]
+        row = [chrom+":"+str(start)+"-"+str(end),isValid_bnd([chrom,start,end],realSV,m),nb_common,None,None,None,None]
+        if not np.isnan(c).any():
+            row[3] = float(c.mean())
+            row[4] = float(c.std())
+            if c.std() > 0:
+                row[5] = float((nb_common - c.mean()) / c.std())
+            row[6] = float((1 + (c >= nb_common).sum()) / (n + 1))
+        rows.append(row)
+    return rows
+
+
+def scan_signal(arrays,nb_bx,length,step,shift,gap=GAP):
+    '''
+        Returns the positions p of a chromosome (every step) and the number of
+        common barcodes between the windows p+-gap and p+shift+-gap (numpy arrays).
+        The barcode counters of both windows are updated as they slide, each
+        read enters and leaves each window once.
+
+        arrays -- arrays from chrom_arrays()
+        nb_bx -- number of barcodes from chrom_arrays()
+        length -- chromosome's length
+        step -- space between two positions
+        shift -- distance between the two windows
+    '''
+    (starts,ends,ids) = arrays
+    byend = np.argsort(ends,kind="stable")
+    sorted_ends = ends[byend]
+    P = np.arange(gap,length - shift - gap,step)
+    signal = np.zeros(len(P),dtype=np.int32)
+    C = [nb_bx * [0],nb_bx * [0]] # reads of each barcode in the left and right windows
+    entered = [0,0]
+    left = [0,0]
+    common = 0
+    for (k,p) in enumerate(P.tolist()):
+        for w in range(2):
+            c = C[w]
+            other = C[1-w]
+            ws = p - gap + w * shift
+            # reads starting before the end of the window :
+            i = int(np.searchsorted(starts,ws + 2 * gap))
+            for bx in ids[entered[w]:i].tolist():
+                c[bx] += 1
+                if c[bx] == 1 and other[bx] > 0:
+                    common += 1
+            entered[w] = i
+            # reads ending before the start of the window :
+            i = int(np.searchsorted(sorted_ends,ws,side="right"))
+            for bx in ids[byend[left[w]:i]].tolist():
+                c[bx] -= 1
+                if c[bx] == 0 and other[bx] > 0:
+                    common -= 1
+            left[w] = i
+        signal[k] = common
+    return P,signal
+
+
+def call_peaks(P,signal,step,fold):
+    '''
+        Returns the regions where the signal is at least fold times above
+        ("high") or below ("low") its median (list of (start,end,kind,score)).
+
+        P -- positions from scan_signal()
+        signal -- signal from scan_signal()
+        step -- space between two positions
+        fold -- minimal ratio to the median
     '''
-    c = v.alt.split(':')
-    try:
-        c = c[1].split(']')
-        return int(c[0])
-    except ValueError:
-        c = c[0].split('[')
-        return int(c[0])
+    peaks = []
+    if len(signal) == 0:
+        return peaks
+    med = float(np.median(signal))
+    kind = np.full(len(signal),"",dtype=object)
+    kind[signal >= fold * med] = "high"
+    kind[signal * fold <= med] = "low"
+    if med == 0:
+        kind[:] = ""
+        kind[signal > 0] = "high"
+    i = 0
+    while i < len(signal):
+        j = i + 1
+        while j < len(signal) and kind[j] == kind[i]:
+            j += 1
+        if kind[i] != "":
+            score = signal[i:j].max() if kind[i] == "high" else signal[i:j].min()
+            peaks.append((int(P[i]),int(P[j-1]) + step,kind[i],int(score)))
+        i = j
+    return peaks
 
 
-def sortSV(vcf,bam,truth,margin):
+def scan(bams,chroms,step,shift,fold,out="results",hts={},blacklist=None,filters=None):
+    '''
+        Computes the number of common barcodes between two sliding windows
+        along whole chromosomes.
+        Creates out_scan_<chrom>.bedGraph (signal) and out_scan_<chrom>.bed (peaks).
+
+        bams -- list of bam files with reads mapping in the genome reference (pooled)
+        chroms -- list of chromosome names
+        step -- space between two positions
+        shift -- distance between the two windows
+        fold -- minimal ratio to the median for a peak
+        out -- prefix of the output files
+        hts -- dict of options to open the bam/cram files (see libraries.open_alignment())
+        blacklist -- file of barcodes skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+    '''
+    B = Blacklist(blacklist) if blacklist is not None else None
+    samfiles = [open_alignment(bam,**hts) for bam in bams]
+    for chrom in chroms:
+        print("scan",chrom)
+        arrays,nb_bx = chrom_arrays(samfiles,chrom,B,filters)
+        P,signal = scan_signal(arrays,nb_bx,samfiles[0].get_reference_length(chrom),step,shift)
+        with open(out+"_scan_"+chrom+".bedGraph","w") as filout:
+            filout.write("track type=bedGraph name=common_barcodes_"+chrom+"\n")
+            for (p,c) in zip(P.tolist(),signal.tolist()):
+                filout.write(chrom+"\t"+str(p)+"\t"+str(p+step)+"\t"+str(c)+"\n")
+        with open(out+"_scan_"+chrom+".bed","w") as filout:
+            for (a,b,kind,score) in call_peaks(P,signal,step,fold):
+                filout.write(chrom+"\t"+str(a)+"\t"+str(b)+"\t"+kind+"\t"+str(score)+"\n")
+    for samfile in samfiles:
+        samfile.close()
+    if B is not None:
+        print(B.report())
+    if filters is not None:
+        print(filters.report())
+
+
+def get_cln(length):
+    '''
+        Returns the first column of the class of length of a variant.
+
+        length -- variant's length
+    '''
+    if length < L_SV[0]:
+        return 0
+    if length < L_SV[1]:
+        return 6
+    return 12
+
+
+def sortSV(vcfs,bams,truth,margin,cache_size=0,null=0,seed=0,out="results",tsv=False,hts={},blacklist=None,filters=None,sort=False):
     '''
         Creates results.xlsx containing the number of barcodes for real
         variants and false one.
+        With several bam files, a worksheet for the pooled libraries is
+        followed by a worksheet for each library.
+        With several vcf files, their regions are evaluated once, in the
+        order of the genome, and each vcf file has its own worksheets.
         
-        vcf -- vcf file with variants
-        bam -- bam file with reads mapping in the genome reference
+        vcfs -- list of vcf files with variants (file or name=file)
+        bams -- list of bam files with reads mapping in the genome reference
         truth -- file with real variants
         margin -- boolean
+        cache_size -- memory budget of the region cache in MB (0 for no cache)
+        null -- number of random pairs of windows by variant (0 for no null model)
+        seed -- seed of the random generator of the null model
+        out -- name of the results, without extension
+        tsv -- boolean, also writes the results in out.tsv, or out_<name>.tsv for each vcf file (for shard.py)
+        hts -- dict of options to open the bam/cram files (see libraries.open_alignment())
+        blacklist -- file of barcodes skipped by the metric (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+        sort -- boolean, sorts the variants of the vcf files and groups the BND mates first (unsorted vcf files)
     '''
-    cpt = 1
-    L = []
-    row = 15 * [0]
+    B = Blacklist(blacklist) if blacklist is not None else None
     m = 100 if margin else 0
     realSV = trueSV(truth)
-    samfile = pysam.AlignmentFile(bam,"rb")
-    workbook = xlsxwriter.Workbook('results.xlsx')
-    worksheet = workbook.add_worksheet()
-    # Used to store current chromosomes for BND, and to output BND when changing chromosome
-    curChr1 = ""
-    curChr2 = ""
-    with open(vcf,"r") as filin:
-        # skips file's head :
-        line = filin.readline()
-        while line.startswith('#'):
-            line = filin.readline()
-        # for each variant :
-        while line != '':
-            v = Variant(line)
-            print("variant",cpt)
-            cpt += 1
-            # We keep filling L if both chromosomes correspond to current one
-            # If not, this means we're not processing the same variant anymore, so we treat the BND we've read so far
-            if v.get_svtype() == "BND" and ((curChr1 == "" and curChr2 == "") or (curChr1 == v.chrom and curChr2 == get_chrom_bnd(v))):
-                if L ==[]:
-                    L.append([v.chrom,v.pos,-1])
-                    L.append([get_chrom_bnd(v),get_pos_bnd(v),-1])
-                    curChr1 = v.chrom
-                    curChr2 = get_chrom_bnd(v)
-                else:
-                    if v.pos > L[0][2]:
-                        L[0][2] = v.pos
-                    if get_pos_bnd(v) > L[1][2]:
-                        L[1][2] = get_pos_bnd(v)
-            else:
-                # we treat the BND variants :
-                if L != [] and L[0][2] != -1 and L[1][2] != -1:
-                    all_Bx1 = get_all_Bx(samfile,L[0][0],L[0][1]-GAP,L[0][1]+GAP)
-                    all_Bx2 = get_all_Bx(samfile,L[0][0],L[0][2]-GAP,L[0][2]+GAP)
-                    all_Bx_pair1 = get_all_Bx(samfile,L[1][0],L[1][1]-GAP,L[1][1]+GAP)
-                    all_Bx_pair2 = get_all_Bx(samfile,L[1][0],L[1][2]-GAP,L[1][2]+GAP)
-                    nb_common1 = intersection(all_Bx1,all_Bx2)
-                    nb_common2 = intersection(all_Bx_pair1,all_Bx_pair2)
-                    # first BND variant is valid :
-                    if L[0][2] - L[0][1] < L_SV[0]:
-                    		cln = 0
-                    if L_SV[0] <= L[0][2] - L[0][1] < L_SV[1]:
-                    		cln = 6
-                    if L[0][2] - L[0][1] >= L_SV[1]:
-                    		cln = 12
-                    if isValid_bnd(L[0],realSV,m):
-                        worksheet.write(row[cln],cln,L[0][0]+":"+str(L[0][1])+"-"+str(L[0][2]))
-                        worksheet.write(row[cln],cln+1,nb_common1)
-                        row[cln] += 1
-                    # first BND variant is not valid :
-                    else:
-                        worksheet.write(row[cln+2],cln+2,L[0][0]+":"+str(L[0][1])+"-"+str(L[0][2]))
-                        worksheet.write(row[cln+2],cln+3,nb_common1)
-                        row[cln+2] += 1
-                    # second BND variant is valid :
-                    if L[1][2] - L[1][1] < L_SV[0]:
-                    		cln = 0
-                    if L_SV[0] <= L[1][2] - L[1][1] < L_SV[1]:
-                    		cln = 6
-                    if L[1][2] - L[1][1] >= L_SV[1]:
-                    		cln = 12
-                    if isValid_bnd(L[1],realSV,m):
-                        worksheet.write(row[cln],cln,L[1][0]+":"+str(L[1][1])+"-"+str(L[1][2]))
-                        worksheet.write(row[cln],cln+1,nb_common2)
-                        row[cln] += 1
-                    # second BND variant is not valid :
-                    else:
-                        worksheet.write(row[cln+2],cln+2,L[1][0]+":"+str(L[1][1])+"-"+str(L[1][2]))
-                        worksheet.write(row[cln+2],cln+3,nb_common2)
-                        row[cln+2] += 1
-                    L = []
-                    # Update current chromosomes and L if we read a BND, otherwise set them / leave them empty
-                    if v.get_svtype() == "BND":
-                        L.append([v.chrom,v.pos,-1])
-                        L.append([get_chrom_bnd(v),get_pos_bnd(v),-1])
-                        curChr1 = v.chrom
-                        curChr2 = get_chrom_bnd(v)
-                    else:
-                        curChr1 = ""
-                        curChr2 = ""
-                # treatment of a non BND variant :
-                # Only do if we didn't read a BND
-                if v.get_svtype() != "BND":
-                    end = v.get_end()
-                    all_Bx1 = get_all_Bx(samfile,v.chrom,v.pos-GAP,v.pos+GAP)
-                    all_Bx2 = get_all_Bx(samfile,v.chrom,end-GAP,end+GAP)
-                    nb_common = intersection(all_Bx1,all_Bx2)
-                    if end - v.pos < L_SV[0]:
-                    		cln = 0
-                    if L_SV[0] <= end - v.pos < L_SV[1]:
-                    		cln = 6
-                    if end - v.pos >= L_SV[1]:
-                    		cln = 12
-                    # variant is valid :
-                    if isValid(v,realSV,m):
-                        worksheet.write(row[cln],cln,v.chrom+":"+str(v.pos)+"-"+str(end))
-                        worksheet.write(row[cln],cln+1,nb_common)
-                        row[cln] += 1
-                    # variant is not valid :
-                    else:
-                        worksheet.write(row[cln+2],cln+2,v.chrom+":"+str(v.pos)+"-"+str(end))
-                        worksheet.write(row[cln+2],cln+3,nb_common)
-                        row[cln+2] += 1
-            line = filin.readline()
+    samfiles,pool = open_libraries(bams,hts)
+    caches = [RegionCache(cache_size * 1024 * 1024 // len(bams)) if cache_size > 0 else None for bam in bams]
+    names,files = get_sources(vcfs)
+    E,plan = get_plan(files,sort)
+    V = {}
+    # for each region, in the order of the genome :
+    for (i,(chrom,start,end)) in enumerate(plan):
+        print("region",i+1,"/",len(plan))
+        all_Bx1 = query(pool,get_all_Bx,samfiles,caches,chrom,start-GAP,start+GAP,blacklist=B,filters=filters)
+        all_Bx2 = query(pool,get_all_Bx,samfiles,caches,chrom,end-GAP,end+GAP,blacklist=B,filters=filters)
+        nb_common = [intersection(all_Bx1[j],all_Bx2[j]) for j in range(len(samfiles))]
+        if len(samfiles) > 1:
+            nb_common = [intersection(namespace(all_Bx1),namespace(all_Bx2))] + nb_common
+        cln = get_cln(end - start)
+        # variant is not valid :
+        if not isValid_bnd([chrom,start,end],realSV,m):
+            cln += 2
+        V[(chrom,start,end)] = (cln,nb_common)
+    tables = None
+    if null > 0:
+        # the null model is drawn once for each region of the plan :
+        P = dict(zip(plan,null_model(samfiles,[region+(V[region][1][0],) for region in plan],null,seed,B,filters)))
+        tables = []
+        for (s,name) in enumerate(names):
+            R = [region+(V[region][1][0],) for region in E[s]]
+            tables.append([("null" if len(names) == 1 else name+"_null",NULL_TITLES,null_rows(R,[P[region] for region in E[s]],realSV,m,null))])
+    workbook = xlsxwriter.Workbook(out+'.xlsx')
+    write_sources(workbook,bams,names,files,E,V,out,tsv,tables)
     workbook.close()
-    samfile.close()
+    pool.shutdown()
+    for samfile in samfiles:
+        samfile.close()
+    for cache in caches:
+        if cache is not None:
+            print(cache.report())
+    if B is not None:
+        print(B.report())
+    if filters is not None:
+        print(filters.report())
+
+
+def sortMatrix(vcfs,bams,k,dist,out="results",hts={},blacklist=None,filters=None):
+    '''
+        Computes the number of common barcodes between every pair of breakpoint
+        windows of a chromosome, with one sparse matrix product.
+        Creates out_links.xlsx with the top-k links, or out_matrix_<chrom>.npz
+        (full matrices) and out_windows_<chrom>.txt if k is 0.
+
+        vcfs -- list of vcf files with variants (file or name=file), their windows are merged
+        bams -- list of bam files with reads mapping in the genome reference (pooled)
+        k -- number of links to keep by chromosome (0 for the full matrix)
+        dist -- maximal distance between two windows (None for no limit)
+        out -- prefix of the output files
+        hts -- dict of options to open the bam/cram files (see libraries.open_alignment())
+        blacklist -- file of barcodes skipped (None for none)
+        filters -- ReadFilter object, drops reads on their flag and MAPQ (None for no filter)
+    '''
+    B = Blacklist(blacklist) if blacklist is not None else None
+    samfiles = [open_alignment(bam,**hts) for bam in bams]
+    W = breakpoint_windows(get_sources(vcfs)[1])
+    if k > 0:
+        workbook = xlsxwriter.Workbook(out+'_links.xlsx')
+        worksheet = workbook.add_worksheet()
+        row = 0
+    for chrom in W:
+        print("chromosome",chrom,len(W[chrom]),"windows")
+        S = shared_matrix(incidence(samfiles,chrom,W[chrom],B,filters))
+        if k > 0:
+            for (w1,w2,nb_common) in top_links(S,W[chrom],k,dist):
+                worksheet.write(row,0,chrom+":"+str(w1[0])+"-"+str(w1[1]))
+                worksheet.write(row,1,chrom+":"+str(w2[0])+"-"+str(w2[1]))
+                worksheet.write(row,2,nb_common)
+                row += 1
+        else:
+            sparse.save_npz(out+"_matrix_"+chrom+".npz",S.tocsr())
+            with open(out+"_windows_"+chrom+".txt","w") as filout:
+                for [a,b] in W[chrom]:
+                    filout.write(chrom+"\t"+str(a)+"\t"+str(b)+"\n")
+    if k > 0:
+        workbook.close()
+    for samfile in samfiles:
+        samfile.close()
+    if B is not None:
+        print(B.report())
+    if filters is not None:
+        print(filters.report())
 
 ####################################################
 
 
 parser = argparse.ArgumentParser(description='Sort SV')
-parser.add_argument('-vcf', type=str, required=True, help='vcf file')
-parser.add_argument('-bam', type=str, required=True, help='bam file')
-parser.add_argument('-t', type=str, required=True, help='Truth file')
+parser.add_argument('-vcf', type=str, nargs='+', help='vcf file(s), as file or name=file, evaluated at once')
+parser.add_argument('-bam', type=str, nargs='+', required=True, help='bam file(s), queried concurrently')
+parser.add_argument('-t', type=str, help='Truth file')
 parser.add_argument('-m', action='store_true', help="Allows a margin to increase variants's length")
+parser.add_argument('-o', type=str, default='results', help='Name of the results, without extension')
+parser.add_argument('-tsv', action='store_true', help='Also writes the results in a tsv file (for shard.py)')
+parser.add_argument('-ref', type=str, default=None, help='fasta file of the genome reference (needed for cram files)')
+parser.add_argument('-ref_cache', type=str, default=None, help='Local cache of the reference sequences for cram files')
+parser.add_argument('-threads', type=int, default=1, help='Number of decompression threads for each bam/cram file')
+parser.add_argument('-sort', action='store_true', help='Sorts the variants and groups the BND mates first (unsorted vcf files)')
+parser.add_argument('-mapq', type=int, default=0, help='Minimal mapping quality of the reads')
+parser.add_argument('-filter', type=str, nargs='+', default=[], choices=list(FLAGS), help='Kinds of reads skipped (flag bits)')
+parser.add_argument('-blacklist', type=str, default=None, help='File of barcodes skipped by the metric (made by bcistats.py)')
+parser.add_argument('-cache', type=int, default=0, help='Memory budget of the region cache in MB (0 for no cache)')
+parser.add_argument('-null', type=int, default=0, help='Number of random pairs of windows by variant for the p-values (0 for no null model)')
+parser.add_argument('-seed', type=int, default=0, help='Seed of the random generator of the null model')
+parser.add_argument('-matrix', action='store_true', help='Common barcodes between all pairs of breakpoint windows')
+parser.add_argument('-k', type=int, default=100, help='Number of links kept by chromosome with -matrix (0 for the full matrix)')
+parser.add_argument('-dist', type=int, default=None, help='Maximal distance between two linked windows with -matrix')
+parser.add_argument('-scan', type=str, nargs='+', default=None, help='Chromosomes scanned with sliding windows')
+parser.add_argument('-step', type=int, default=100, help='Space between two positions with -scan')
+parser.add_argument('-shift', type=int, default=2*GAP, help='Distance between the two windows with -scan')
+parser.add_argument('-fold', type=float, default=2, help='Minimal ratio to the median for a peak with -scan')
 args = parser.parse_args()
+if args.scan is None and args.vcf is None:
+    parser.error("the following arguments are required: -vcf")
+if args.scan is None and not args.matrix and args.t is None:
+    parser.error("the following arguments are required: -t")
 
 if __name__ == '__main__':
-    if args.m:
-        sortSV(args.vcf,args.bam,args.t,True)
+    hts = {"reference" : args.ref, "ref_cache" : args.ref_cache, "threads" : args.threads}
+    F = ReadFilter(args.mapq,args.filter) if args.mapq > 0 or args.filter != [] else None
+    if args.scan is not None:
+        scan(args.bam,args.scan,args.step,args.shift,args.fold,args.o,hts,args.blacklist,F)
+    elif args.matrix:
+        sortMatrix(args.vcf,args.bam,args.k,args.dist,args.o,hts,args.blacklist,F)
+    elif args.m:
+        sortSV(args.vcf,args.bam,args.t,True,args.cache,args.null,args.seed,args.o,args.tsv,hts,args.blacklist,F,args.sort)
     else:
-        sortSV(args.vcf,args.bam,args.t,False)
+        sortSV(args.vcf,args.bam,args.t,False,args.cache,args.null,args.seed,args.o,args.tsv,hts,args.blacklist,F,args.sort)
 